@@ -5,7 +5,9 @@ prefix: /apps
 from fastapi import APIRouter
 from .auth import router as auth_router
 from .advertisement import router as advertisement_router
+from .leaderboard import router as leaderboard_router
 
 router = APIRouter()
 router.include_router(auth_router, prefix="/auth")
 router.include_router(advertisement_router, prefix="/advertisement")
+router.include_router(leaderboard_router, prefix="/leaderboard")
@@ -1,9 +1,12 @@
+import datetime
 import os
+import tempfile
 import uuid
 from enum import Enum
 from typing import List
 from fastapi import (
     APIRouter,
+    BackgroundTasks,
     Depends,
     HTTPException,
     status,
@@ -11,46 +14,42 @@ from fastapi import (
     File,
     Form,
     Body,
-    Response,
+    Request,
     Query,
 )
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
+from starlette.concurrency import run_in_threadpool
 from app.utils.utils import get_current_user
 from app.auth.models.user import User
-from app.advertisement.service import database
-from app.auth.service import coupon_db
+from app.advertisement.service import analytics, database, async_database, images
+from app.advertisement.service.feed_cache import feed_cache, normalize_advertisement
+from app.auth.service import async_coupon_db, coupon_ingest
+from app.utils import mail
+from app.utils.counters import counters
+from app.utils.files import file_response, save_upload
+from app.utils.responses import json_response
+from app.utils.pagination import (
+    MAX_PAGE_SIZE,
+    PageParams,
+    parse_fields,
+    project,
+    set_next_cursor,
+)
 
 router = APIRouter()
 
 UPLOAD_DIR = "uploads"
 
-server_email = os.getenv("EMAIL_ADDRESS")
-server_email_password = os.getenv("EMAIL_PASSWORD")
 admin_email = os.getenv("ADMIN_EMAIL")
 
-# Mail connection configuration
-conf = ConnectionConfig(
-    MAIL_USERNAME=server_email,
-    MAIL_PASSWORD=server_email_password,
-    MAIL_FROM="treetap.yyy@gmail.com",
-    MAIL_PORT=465,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-)
-
 
 class MediaTypeEnum(str, Enum):
     png = "image/png"
     jpg = "image/jpeg"
 
 
-# Create FastMail instance
-mail = FastMail(conf)
-
-
 @router.post("/register", tags=["advertisement"])
 async def request_advertisement(
+    background_tasks: BackgroundTasks,
     company_name: str = Form(...),
     website: str = Form(...),
     coupon_info: str = Form(...),
@@ -61,6 +60,12 @@ async def request_advertisement(
     ),
     current_user: User = Depends(get_current_user),
 ):
+    # Reject files that are not valid PNG or JPEG images
+    try:
+        await run_in_threadpool(images.validate_image, advertisement_image.file)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     # Create new advertisement object
     advertisement = {
         "company_name": company_name,
@@ -77,16 +82,18 @@ async def request_advertisement(
     file_extension = os.path.splitext(advertisement_image.filename)[1]
     unique_filename = str(uuid.uuid4()) + file_extension
     file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    with open(file_path, "wb") as f:
-        f.write(advertisement_image.file.read())
+    await run_in_threadpool(save_upload, advertisement_image.file, file_path)
 
     # Add the file path to the advertisement object
     advertisement["advertisement_image"] = file_path
 
     # Insert new advertisement object into the database
-    database.add_advertisement(advertisement)
-    # Send notification email to the specified email address
-    message = MessageSchema(
+    advertisement_id = await async_database.add_advertisement(advertisement)
+    # Resize the image into its renditions once the response has been sent
+    background_tasks.add_task(images.generate_renditions, advertisement_id, file_path)
+
+    # Queue notification email to the specified email address
+    await mail.enqueue_message(
         subject="New Advertisement Created",
         recipients=[admin_email],
         body=f"Dear Admin,\n\nA new advertisement has been created by {current_user.emailAddress}."
@@ -95,10 +102,9 @@ async def request_advertisement(
         f"Best regards,\nTree Tap YYY",
         subtype="plain",
     )
-    await mail.send_message(message)
 
-    # Send confirmation email to the user
-    user_message = MessageSchema(
+    # Queue confirmation email to the user
+    await mail.enqueue_message(
         subject="Advertisement Request Received",
         recipients=[current_user.emailAddress],
         body=f"Dear {current_user.emailAddress},\n\nThank you for submitting your advertisement request. "
@@ -106,7 +112,6 @@ async def request_advertisement(
         f"with you shortly regarding the status of your request.\n\nBest regards,\nTree Tap YYY",
         subtype="plain",
     )
-    await mail.send_message(user_message)
 
     return {"message": "Advertisement created successfully"}
 
@@ -119,7 +124,7 @@ async def approve_advertisement(
     current_user: User = Depends(get_current_user),
 ):
     # Retrieve the advertisement from the database
-    advertisement = database.get_advertisement(advertisement_id)
+    advertisement = await async_database.get_advertisement(advertisement_id)
     if not advertisement:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Advertisement not found"
@@ -132,35 +137,33 @@ async def approve_advertisement(
             detail="Only administrators can approve advertisements",
         )
 
-    # Check if the coupon codes are valid and not duplicates
-    if len(coupon_codes) != len(set(coupon_codes)):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate coupon codes"
-        )
-
-    database.approve_advertisement(advertisement_id, ngo)
+    await async_database.approve_advertisement(advertisement_id, ngo)
 
-    # Add coupon codes to the coupons collection
-    for code in coupon_codes:
-        coupon = {"advertisement_id": advertisement_id, "code": code}
-        coupon_db.add_coupon(coupon)
+    # Add coupon codes to the coupons collection, duplicates are skipped
+    result = await run_in_threadpool(
+        coupon_ingest.ingest_coupon_codes, advertisement_id, coupon_codes
+    )
+    feed_cache.invalidate()
 
-    # Send notification email to the advertiser
+    # Queue notification email to the advertiser
     advertiser_email = advertisement["created_by"]
-    message = MessageSchema(
+    await mail.enqueue_message(
         subject="Advertisement Approved",
         recipients=[advertiser_email],
         body="Dear Advertiser,\n\nYour advertisement has been approved and is now live. "
         "Thank you for using our service!\n\nBest regards,\nTree Tap",
         subtype="plain",
     )
-    await mail.send_message(message)
 
-    return {"message": "Advertisement approved successfully"}
+    return {"message": "Advertisement approved successfully", **result}
 
 
 @router.get("/admin", tags=["advertisement"])
-async def get_all_advertisements(current_user: User = Depends(get_current_user)):
+async def get_all_advertisements(
+    request: Request,
+    page: PageParams = Depends(),
+    current_user: User = Depends(get_current_user),
+):
     # Check if the current user is authorized to access the advertisements
     if current_user.emailAddress != admin_email:
         raise HTTPException(
@@ -168,46 +171,76 @@ async def get_all_advertisements(current_user: User = Depends(get_current_user))
             detail="Only administrators can access advertisements",
         )
 
-    advertisements = database.get_all_advertisements()
-    # Convert binary image data to base64-encoded string
+    advertisements = await async_database.get_all_advertisements(
+        page.after, page.limit, page.projection
+    )
     for advertisement in advertisements:
-        advertisement["_id"] = str(advertisement["_id"])
-        advertisement["advertisement_content"] = advertisement[
-            "advertisement_content"
-        ].replace("\\n", "")
+        normalize_advertisement(advertisement)
 
-    return advertisements
+    response = json_response(request, advertisements)
+    set_next_cursor(response, advertisements, page.limit)
+    return response
 
 
 @router.get("/", tags=["advertisement"])
-async def get_approved_advertisements(current_user: User = Depends(get_current_user)):
-    # Retrieve approved advertisements from MongoDB
-    approved_advertisements = database.get_approved_advertisements()
-
-    # Convert binary image data to base64-encoded string
-    for advertisement in approved_advertisements:
-        advertisement["_id"] = str(advertisement["_id"])
-        advertisement["advertisement_content"] = advertisement[
-            "advertisement_content"
-        ].replace("\\n", "")
-        exists = coupon_db.check_if_user_already_has_coupon(
-            advertisement["_id"], current_user.emailAddress
+async def get_approved_advertisements(
+    request: Request,
+    page: PageParams = Depends(),
+    current_user: User = Depends(get_current_user),
+):
+    # Retrieve approved advertisements from the shared feed cache
+    approved_advertisements = await feed_cache.get_page(page.after, page.limit)
+    # Fetch every advertisement the user already has a coupon for in one query
+    user_advertisement_ids = await async_coupon_db.get_user_coupon_advertisement_ids(
+        current_user.emailAddress
+    )
+
+    # Layer the per-user fields on copies of the shared advertisements
+    response = json_response(
+        request,
+        [
+            {
+                **project(advertisement, page.projection),
+                "already_done": advertisement["_id"] in user_advertisement_ids,
+            }
+            for advertisement in approved_advertisements
+        ],
+    )
+    set_next_cursor(response, approved_advertisements, page.limit)
+    # A 304 to a client revalidating its copy shows nothing new
+    if response.status_code == status.HTTP_200_OK:
+        analytics.record_impressions(
+            [advertisement["_id"] for advertisement in approved_advertisements]
         )
-        if exists:
-            advertisement["already_done"] = True
-        else:
-            advertisement["already_done"] = False
-    return approved_advertisements
+    return response
 
 
 @router.get("/images")
-async def get_image(file_name: str):
-    image_full_path = os.path.join(os.getcwd(), file_name)
-    if os.path.exists(image_full_path):
-        with open(image_full_path, "rb") as image_file:
-            return Response(content=image_file.read(), media_type="image/png")
-    else:
+async def get_image(
+    file_name: str,
+    request: Request,
+    size: str = Query(None, regex="^(thumbnail|feed)$"),
+):
+    # Only files inside the upload directory can be served
+    upload_dir = os.path.realpath(UPLOAD_DIR)
+    image_full_path = os.path.realpath(os.path.join(os.getcwd(), file_name))
+    if os.path.commonpath(
+        [upload_dir, image_full_path]
+    ) != upload_dir or not os.path.isfile(image_full_path):
         raise HTTPException(status_code=404, detail="Image not found")
+    if size is None:
+        return file_response(request, image_full_path)
+
+    # Serve WebP to clients that accept it
+    extension = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    rendition_path = images.get_rendition_path(image_full_path, size, extension)
+    if os.path.isfile(rendition_path):
+        return file_response(request, rendition_path, headers={"Vary": "Accept"})
+    # The original until the renditions have been generated, revalidated so
+    # clients pick up the rendition once it exists
+    return file_response(
+        request, image_full_path, headers={"Vary": "Accept"}, cache_control="no-cache"
+    )
 
 
 @router.put("/{advertisement_id}", tags=["advertisement"])
@@ -222,39 +255,159 @@ async def close_advertisement(
         )
 
     # Update the advertisement to set the closed field to True
-    database.close_advertisement(advertisement_id)
+    await async_database.close_advertisement(advertisement_id)
+    feed_cache.invalidate()
     return {"message": "Advertisement closed successfully"}
 
 
 @router.put("/{advertisement_id}/coupons", tags=["coupons"])
-def refill_coupons(advertisement_id: str, coupon_codes: List[str] = Body(default=[])):
+def refill_coupons(
+    advertisement_id: str,
+    coupon_codes: List[str] = Body(default=[]),
+    current_user: User = Depends(get_current_user),
+):
+    # Check if the current user is authorized to add coupons
+    if current_user.emailAddress != admin_email:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Only administrators can add coupons",
+        )
+
     advertisement = database.get_advertisement(advertisement_id)
     if not advertisement:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Advertisement not found"
         )
 
-    current_coupons = coupon_db.get_ad_coupons(advertisement_id)
-    current_coupon_codes = [c["code"] for c in current_coupons]
+    # Add the new coupon codes to the database, codes the advertisement
+    # already has are counted as duplicates
+    result = coupon_ingest.ingest_coupon_codes(advertisement_id, coupon_codes)
+    return {
+        "message": f"{result['accepted']} coupon codes added successfully",
+        **result,
+    }
+
 
-    # Check if any of the new coupon numbers already exist
-    duplicates = set(current_coupon_codes) & set(coupon_codes)
-    if duplicates:
+@router.post(
+    "/{advertisement_id}/coupons/upload",
+    tags=["coupons"],
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def upload_coupons(
+    advertisement_id: str,
+    background_tasks: BackgroundTasks,
+    coupon_file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+):
+    # Check if the current user is authorized to add coupons
+    if current_user.emailAddress != admin_email:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Duplicate coupon numbers: {', '.join(duplicates)}",
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Only administrators can upload coupons",
         )
-    # Add the new coupon codes to the database
-    new_coupons = [
-        {"advertisement_id": advertisement_id, "coupon_code": c} for c in coupon_codes
-    ]
-    coupon_db.add_coupons(new_coupons)
-    return {"message": f"{len(new_coupons)} coupon codes added successfully"}
+
+    advertisement = await async_database.get_advertisement(advertisement_id)
+    if not advertisement:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Advertisement not found"
+        )
+
+    # Spool the upload to disk, it is ingested after the response is sent
+    fd, file_path = tempfile.mkstemp(prefix="coupons-", suffix=".csv")
+    os.close(fd)
+    await run_in_threadpool(save_upload, coupon_file.file, file_path)
+    job_id = await run_in_threadpool(
+        coupon_ingest.create_job,
+        advertisement_id,
+        current_user.emailAddress,
+        os.path.getsize(file_path),
+    )
+    background_tasks.add_task(coupon_ingest.run_job, job_id, file_path)
+    return {"job_id": job_id}
+
+
+@router.get("/coupons/jobs/{job_id}", tags=["coupons"])
+def get_coupon_upload_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = coupon_ingest.get_job(job_id)
+    if not job or current_user.emailAddress not in (admin_email, job["created_by"]):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload job not found"
+        )
+    job["_id"] = str(job["_id"])
+    return job
+
+
+@router.get("/{advertisement_id}/stock", tags=["coupons"])
+async def get_coupon_stock(
+    advertisement_id: str, current_user: User = Depends(get_current_user)
+):
+    advertisement = await async_database.get_advertisement(advertisement_id)
+    if not advertisement:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Advertisement not found"
+        )
+
+    # Only administrators and the advertiser can see the stock level
+    if current_user.emailAddress not in (admin_email, advertisement["created_by"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Only administrators and the advertiser can access the stock",
+        )
+
+    if "coupons_total" in advertisement:
+        total = advertisement["coupons_total"]
+        # Claims not yet written by the counter aggregator
+        remaining = advertisement["coupons_remaining"] + counters.pending(
+            "advertisements", {"_id": advertisement["_id"]}, "coupons_remaining"
+        )
+    else:
+        total, remaining = await async_coupon_db.count_coupons(advertisement_id)
+    return {
+        "total": total,
+        "remaining": remaining,
+        "claimed": total - remaining,
+        "closed": advertisement["closed"],
+    }
+
+
+@router.get("/{advertisement_id}/analytics", tags=["advertisement"])
+def get_advertisement_analytics(
+    advertisement_id: str,
+    granularity: str = Query("day", regex="^(hour|day)$"),
+    days: int = Query(7, ge=1, le=90),
+    current_user: User = Depends(get_current_user),
+):
+    advertisement = database.get_advertisement(advertisement_id)
+    if not advertisement:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Advertisement not found"
+        )
+
+    # Only administrators and the advertiser can see the analytics
+    if current_user.emailAddress not in (admin_email, advertisement["created_by"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Only administrators and the advertiser can access the analytics",
+        )
+
+    end = datetime.datetime.utcnow()
+    start = analytics.get_bucket(end - datetime.timedelta(days=days), granularity)
+    rollups = analytics.get_rollups(advertisement_id, granularity, start, end)
+    return {
+        "granularity": granularity,
+        "buckets": rollups,
+        "summary": analytics.summarize(
+            rollups, start, end, advertisement.get("coupons_remaining")
+        ),
+    }
 
 
 @router.get("/filter", tags=["advertisement"])
 async def get_advertisements_of_ids(
-    advertisement_ids: str = Query(None), current_user: User = Depends(get_current_user)
+    request: Request,
+    advertisement_ids: str = Query(None),
+    fields: str = Query(None),
+    current_user: User = Depends(get_current_user),
 ):
     if advertisement_ids is None:
         raise HTTPException(
@@ -263,7 +416,17 @@ async def get_advertisements_of_ids(
         )
 
     advertisement_ids = advertisement_ids.split(",")
-    approved_advertisements = database.get_approved_advertisements_by_ids(
-        advertisement_ids
+    if len(advertisement_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_PAGE_SIZE} advertisement_ids can be requested",
+        )
+    approved_advertisements = await async_database.get_approved_advertisements_by_ids(
+        advertisement_ids, parse_fields(fields)
     )
-    return approved_advertisements
+    response = json_response(request, approved_advertisements)
+    if response.status_code == status.HTTP_200_OK:
+        analytics.record_impressions(
+            [advertisement["_id"] for advertisement in approved_advertisements]
+        )
+    return response
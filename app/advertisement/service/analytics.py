@@ -0,0 +1,116 @@
+# analytics.py
+import datetime
+import os
+
+from pymongo import ASCENDING
+
+from app.utils.counters import counters
+from app.utils.mongo import get_db
+
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "true").lower() == "true"
+
+# Events are summed into one document per advertisement and bucket, for each
+# of these granularities
+GRANULARITIES = ("hour", "day")
+_fields = ("impressions", "clicks", "trees_planted")
+
+
+def get_bucket(time: datetime.datetime, granularity: str):
+    # Start of the bucket the time falls into, in UTC
+    bucket = time.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        bucket = bucket.replace(hour=0)
+    return bucket
+
+
+def _record(advertisement_ids, field: str, amount: int = 1):
+    # Only the in-memory sums are updated here, the counter aggregator
+    # upserts them into the bucket documents with one bulk write per flush
+    now = datetime.datetime.utcnow()
+    buckets = {
+        granularity: get_bucket(now, granularity) for granularity in GRANULARITIES
+    }
+    for advertisement_id in advertisement_ids:
+        for granularity, bucket in buckets.items():
+            counters.increment(
+                "advertisement_stats",
+                {
+                    "advertisement_id": advertisement_id,
+                    "granularity": granularity,
+                    "bucket": bucket,
+                },
+                field,
+                amount,
+                upsert=True,
+            )
+
+
+def record_impressions(advertisement_ids):
+    if ANALYTICS_ENABLED:
+        _record(advertisement_ids, "impressions")
+
+
+def record_click(advertisement_id: str, trees_planted: int):
+    # Every click on /plant claims one coupon, so clicks are also the coupon
+    # depletion
+    if ANALYTICS_ENABLED:
+        _record([advertisement_id], "clicks")
+        _record([advertisement_id], "trees_planted", trees_planted)
+
+
+def get_rollups(
+    advertisement_id: str,
+    granularity: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+):
+    # Pre-aggregated buckets from start up to but excluding end, oldest first
+    buckets = (
+        get_db()
+        .advertisement_stats.find(
+            {
+                "advertisement_id": advertisement_id,
+                "granularity": granularity,
+                "bucket": {"$gte": start, "$lt": end},
+            },
+            {"_id": 0, "bucket": 1, **{field: 1 for field in _fields}},
+        )
+        .sort("bucket", ASCENDING)
+    )
+    rollups = []
+    for bucket in buckets:
+        rollup = {field: bucket.get(field, 0) for field in _fields}
+        rollup["bucket"] = bucket["bucket"]
+        rollup["ctr"] = (
+            round(rollup["clicks"] / rollup["impressions"], 4)
+            if rollup["impressions"]
+            else None
+        )
+        rollups.append(rollup)
+    return rollups
+
+
+def summarize(
+    rollups: list,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    coupons_remaining: int,
+):
+    # Totals over the period and how long the remaining coupons last at the
+    # period's average depletion rate
+    totals = {field: sum(rollup[field] for rollup in rollups) for field in _fields}
+    totals["ctr"] = (
+        round(totals["clicks"] / totals["impressions"], 4)
+        if totals["impressions"]
+        else None
+    )
+    end = min(end, datetime.datetime.utcnow())
+    days = max(end - start, datetime.timedelta()) / datetime.timedelta(days=1)
+    depletion_per_day = totals["clicks"] / days if days else 0
+    totals["coupons_depleted_per_day"] = round(depletion_per_day, 2)
+    totals["days_until_out_of_coupons"] = (
+        round(coupons_remaining / depletion_per_day, 1)
+        if depletion_per_day and coupons_remaining is not None
+        else None
+    )
+    return totals
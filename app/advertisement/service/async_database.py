@@ -0,0 +1,74 @@
+# async_database.py
+from bson import ObjectId
+from pymongo import ASCENDING
+from typing import List
+from app.utils.mongo import get_async_db
+
+
+async def add_advertisement(advertisement):
+    # Insert new advertisement object into the database
+    result = await get_async_db().advertisements.insert_one(advertisement)
+    return str(result.inserted_id)
+
+
+async def get_advertisement(advertisement_id):
+    advertisement = await get_async_db().advertisements.find_one(
+        {"_id": ObjectId(advertisement_id)}
+    )
+    return advertisement
+
+
+async def approve_advertisement(advertisement_id, ngo):
+    # Update the advertisement to set the approved field to True
+    await get_async_db().advertisements.update_one(
+        {"_id": ObjectId(advertisement_id)},
+        {"$set": {"approved": True, "trees_planted": 0, "ngo": ngo}},
+    )
+
+
+async def get_all_advertisements(after=None, limit=None, projection=None):
+    # One page in _id order, starting after the `after` cursor
+    query = {"_id": {"$gt": after}} if after else {}
+    cursor = (
+        get_async_db()
+        .advertisements.find(query, projection)
+        .sort("_id", ASCENDING)
+        .limit(limit or 0)
+        .batch_size(limit or 0)
+    )
+    advertisements = [advertisement async for advertisement in cursor]
+    return advertisements
+
+
+async def get_approved_advertisements():
+    approved_advertisements = await (
+        get_async_db()
+        .advertisements.find({"approved": True, "closed": False})
+        .sort("_id", ASCENDING)
+        .to_list(None)
+    )
+    return approved_advertisements
+
+
+async def close_advertisement(advertisement_id):
+    await get_async_db().advertisements.update_one(
+        {"_id": ObjectId(advertisement_id)}, {"$set": {"closed": True}}
+    )
+
+
+async def get_approved_advertisements_by_ids(
+    advertisement_ids: List[str], projection=None
+):
+    object_ids = [ObjectId(id) for id in advertisement_ids]
+    advertisements = await (
+        get_async_db()
+        .advertisements.find({"_id": {"$in": object_ids}, "approved": True}, projection)
+        .to_list(None)
+    )
+    for advertisement in advertisements:
+        advertisement["_id"] = str(advertisement["_id"])
+        if "advertisement_content" in advertisement:
+            advertisement["advertisement_content"] = advertisement[
+                "advertisement_content"
+            ].replace("\\n", "")
+    return advertisements
@@ -1,70 +1,97 @@
 # database.py
-import os
 
-from pymongo import MongoClient
-from passlib.context import CryptContext
 from bson import ObjectId
-from typing import List
+from pymongo import UpdateOne
+from app.utils.mongo import get_db
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["dev"]
-
-
-def add_advertisement(advertisement):
-    # Insert new advertisement object into the database
-    db.advertisements.insert_one(advertisement)
-
-
-def get_advertisement(advertisement_id):
-    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
-    return advertisement
-
-
-def approve_advertisement(advertisement_id, ngo):
-    # Update the advertisement to set the approved field to True
-    db.advertisements.update_one(
-        {"_id": ObjectId(advertisement_id)},
-        {"$set": {"approved": True, "trees_planted": 0, "ngo": ngo}},
+def get_advertisement(advertisement_id, session=None):
+    advertisement = get_db().advertisements.find_one(
+        {"_id": ObjectId(advertisement_id)}, session=session
     )
+    return advertisement
 
 
-def get_all_advertisements():
-    advertisements = list(db.advertisements.find({}))
-    return advertisements
-
-
-def get_approved_advertisements():
-    approved_advertisements = list(
-        db.advertisements.find({"approved": True, "closed": False})
-    )
-    return approved_advertisements
-
-
-def close_advertisement(advertisement_id):
-    db.advertisements.update_one(
-        {"_id": ObjectId(advertisement_id)}, {"$set": {"closed": True}}
+def close_advertisement(advertisement_id, session=None):
+    get_db().advertisements.update_one(
+        {"_id": ObjectId(advertisement_id)}, {"$set": {"closed": True}}, session=session
     )
 
 
-def increase_trees_planted_in_advertisement(advertisement_id, trees_per_click):
-    db.advertisements.update_one(
+def increase_trees_planted_in_advertisement(
+    advertisement_id, trees_per_click, coupons_claimed=0, session=None
+):
+    increments = {"trees_planted": trees_per_click}
+    if coupons_claimed:
+        increments["coupons_remaining"] = -coupons_claimed
+    get_db().advertisements.update_one(
         {
             "_id": ObjectId(advertisement_id),
         },
-        {"$inc": {"trees_planted": trees_per_click}},
+        {"$inc": increments},
+        session=session,
     )
 
 
-def get_approved_advertisements_by_ids(advertisement_ids: List[str]):
-    object_ids = [ObjectId(id) for id in advertisement_ids]
-    advertisements = list(
-        db.advertisements.find({"_id": {"$in": object_ids}, "approved": True})
+def increase_coupon_inventory(advertisement_id, num_of_coupons):
+    # Returns False if the advertisement has no inventory counters yet, they
+    # have to be computed with repair_coupon_inventory instead
+    result = get_db().advertisements.update_one(
+        {"_id": ObjectId(advertisement_id), "coupons_total": {"$exists": True}},
+        {
+            "$inc": {
+                "coupons_total": num_of_coupons,
+                "coupons_remaining": num_of_coupons,
+            }
+        },
+    )
+    return result.matched_count == 1
+
+
+def repair_coupon_inventory(advertisement_id=None):
+    # Recomputes the inventory counters of one or every advertisement from
+    # the coupons collection. Claims still buffered by running workers are
+    # counted twice, run it while the app is stopped for exact counters.
+    match = {} if advertisement_id is None else {"advertisement_id": advertisement_id}
+    inventories = get_db().coupons.aggregate(
+        [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": "$advertisement_id",
+                    "total": {"$sum": 1},
+                    "remaining": {
+                        "$sum": {"$cond": [{"$ifNull": ["$user_email", False]}, 0, 1]}
+                    },
+                }
+            },
+        ]
+    )
+    operations = []
+    advertisement_ids = []
+    for inventory in inventories:
+        if not ObjectId.is_valid(inventory["_id"]):
+            continue
+        advertisement_ids.append(ObjectId(inventory["_id"]))
+        operations.append(
+            UpdateOne(
+                {"_id": advertisement_ids[-1]},
+                {
+                    "$set": {
+                        "coupons_total": inventory["total"],
+                        "coupons_remaining": inventory["remaining"],
+                    }
+                },
+            )
+        )
+    if operations:
+        get_db().advertisements.bulk_write(operations, ordered=False)
+
+    # Advertisements without any coupon have an empty inventory
+    empty_filter = {"_id": {"$nin": advertisement_ids}}
+    if advertisement_id is not None:
+        empty_filter["_id"]["$eq"] = ObjectId(advertisement_id)
+    get_db().advertisements.update_many(
+        empty_filter, {"$set": {"coupons_total": 0, "coupons_remaining": 0}}
     )
-    for advertisement in advertisements:
-        advertisement["_id"] = str(advertisement["_id"])
-        advertisement["advertisement_content"] = advertisement[
-            "advertisement_content"
-        ].replace("\\n", "")
-    return advertisements
+    return len(operations)
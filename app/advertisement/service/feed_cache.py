@@ -0,0 +1,88 @@
+# feed_cache.py
+import asyncio
+import bisect
+import os
+import time
+
+from app.advertisement.service import async_database
+
+# Upper bound on how stale the feed can be in workers that did not see the
+# change that invalidated it
+FEED_CACHE_TTL_SECONDS = float(os.getenv("FEED_CACHE_TTL_SECONDS", "30"))
+
+
+def normalize_advertisement(advertisement: dict):
+    advertisement["_id"] = str(advertisement["_id"])
+    if "advertisement_content" in advertisement:
+        advertisement["advertisement_content"] = advertisement[
+            "advertisement_content"
+        ].replace("\\n", "")
+    return advertisement
+
+
+class FeedCache:
+    # Approved, open advertisements in _id order, shared by every request of
+    # this worker
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._advertisements = None
+        self._advertisement_ids = None
+        self._version = 0
+        self._loaded_version = -1
+        self._expires_at = 0.0
+        self._lock = None
+
+    def _is_fresh(self):
+        return (
+            self._loaded_version == self._version
+            and time.monotonic() < self._expires_at
+        )
+
+    def invalidate(self):
+        # Safe to call from the threadpool, it only bumps a counter
+        self._version += 1
+
+    async def get(self):
+        # Treat the returned advertisements as read only, they are shared
+        if self._is_fresh():
+            self.hits += 1
+            return self._advertisements
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Single flight: concurrent misses wait for one refresh instead of
+        # each querying the database
+        async with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return self._advertisements
+            self.misses += 1
+            version = self._version
+            advertisements = await async_database.get_approved_advertisements()
+            self._advertisements = [
+                normalize_advertisement(advertisement)
+                for advertisement in advertisements
+            ]
+            self._advertisement_ids = [
+                advertisement["_id"] for advertisement in self._advertisements
+            ]
+            self._loaded_version = version
+            self._expires_at = time.monotonic() + self.ttl
+            return self._advertisements
+
+    async def get_page(self, after=None, limit=None):
+        advertisements = await self.get()
+        start = 0
+        if after is not None:
+            # Stringified ObjectIds sort in the same order as the ObjectIds
+            start = bisect.bisect_right(self._advertisement_ids, str(after))
+        end = start + limit if limit else None
+        return advertisements[start:end]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+feed_cache = FeedCache(FEED_CACHE_TTL_SECONDS)
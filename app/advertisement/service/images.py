@@ -0,0 +1,127 @@
+# images.py
+import logging
+import os
+
+from bson import ObjectId
+from PIL import Image, ImageOps, UnidentifiedImageError
+from app.utils.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+# Larger uploads are refused. Pillow only raises DecompressionBombError at
+# twice its limit and merely warns below that, so validate_image checks the
+# size itself.
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+# Allowed upload formats and the extension of their stripped copy
+ALLOWED_FORMATS = {"PNG": "png", "JPEG": "jpg"}
+
+# Longest side in pixels of each rendition
+RENDITION_SIZES = {"thumbnail": 160, "feed": 720}
+
+# Rendition file formats, in order of preference
+RENDITION_FORMATS = {
+    "webp": {"format": "WEBP", "media_type": "image/webp", "quality": 80},
+    "jpeg": {"format": "JPEG", "media_type": "image/jpeg", "quality": 82},
+}
+
+
+def validate_image(file):
+    # Raises ValueError unless the file is a PNG or JPEG image Pillow can parse
+    try:
+        with Image.open(file) as image:
+            image_format = image.format
+            width, height = image.size
+            image.verify()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ValueError("Invalid image file") from e
+    finally:
+        file.seek(0)
+    if image_format not in ALLOWED_FORMATS:
+        raise ValueError("Only PNG and JPEG images are supported")
+    if width * height > Image.MAX_IMAGE_PIXELS:
+        raise ValueError("Image is too large")
+
+
+def get_rendition_path(image_path: str, size: str, extension: str):
+    stem = os.path.splitext(image_path)[0]
+    return f"{stem}_{size}.{extension}"
+
+
+def _flatten(image):
+    # JPEG has no alpha channel, so transparent areas are put on white
+    if image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    ):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _save(image, image_path: str, **options):
+    # Files are written under a temporary name and moved into place, so they
+    # are never served half written. Pillow only writes the metadata passed
+    # in explicitly, so saving this way also strips EXIF and comments.
+    temporary_path = f"{image_path}.tmp"
+    image.save(temporary_path, **options)
+    os.replace(temporary_path, image_path)
+
+
+def write_renditions(image_path: str):
+    # The oriented copy without metadata is written next to the upload and is
+    # the base name of the renditions. Returns its path and the paths of the
+    # renditions.
+    with Image.open(image_path) as image:
+        image.load()
+        original_format = image.format
+        oriented = ImageOps.exif_transpose(image)
+        stripped_path = get_rendition_path(
+            image_path, "original", ALLOWED_FORMATS[original_format]
+        )
+        if original_format == "JPEG":
+            _save(oriented, stripped_path, format="JPEG", quality=95)
+        else:
+            _save(oriented, stripped_path, format=original_format)
+
+        renditions = {}
+        flattened = _flatten(oriented)
+        for size, max_side in RENDITION_SIZES.items():
+            resized = flattened.copy()
+            resized.thumbnail((max_side, max_side), Image.LANCZOS)
+            renditions[size] = {}
+            for extension, options in RENDITION_FORMATS.items():
+                rendition_path = get_rendition_path(stripped_path, size, extension)
+                _save(
+                    resized,
+                    rendition_path,
+                    format=options["format"],
+                    quality=options["quality"],
+                    optimize=True,
+                )
+                renditions[size][extension] = rendition_path
+    return stripped_path, renditions
+
+
+def generate_renditions(advertisement_id: str, image_path: str):
+    # Runs after the upload response has been sent, the stripped copy becomes
+    # the advertisement's image and the upload, which still carries its EXIF
+    # data such as GPS position and device, is deleted rather than rewritten
+    # so that no served URL changes bytes
+    try:
+        stripped_path, renditions = write_renditions(image_path)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        logger.exception("Could not generate renditions for %s", image_path)
+        return
+
+    get_db().advertisements.update_one(
+        {"_id": ObjectId(advertisement_id)},
+        {
+            "$set": {
+                "advertisement_image": stripped_path,
+                "advertisement_image_variants": renditions,
+            }
+        },
+    )
+    os.remove(image_path)
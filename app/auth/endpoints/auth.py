@@ -1,51 +1,56 @@
 import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-from passlib.context import CryptContext
-from app.auth.service import database
-from app.auth.service import coupon_db
+from app.auth.service import database, async_database
+from app.auth.service import plant_db
 from app.auth.models.user import UserCreate, User
-from app.advertisement.service import database as ad_db
 from app.utils.utils import get_current_user, create_access_token
+from app.utils.files import etag_matches
+from app.utils.pagination import MAX_PAGE_SIZE
+from app.utils.passwords import hash_password, verify_password
 
 router = APIRouter()
 
 # Token expiration time (in minutes)
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
 
-# Initialize password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
+# Number of most recent coupons returned with the profile by default
+PROFILE_COUPONS_LIMIT = 50
 
 # OAuth2 authentication scheme
 
 
-def authenticate_user(emailAddress: str, password: str):
-    user = database.get_user(emailAddress)
+async def authenticate_user(emailAddress: str, password: str):
+    user = await async_database.get_user(emailAddress)
     if not user:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    valid, new_hashed_password = await verify_password(password, user.hashed_password)
+    if not valid:
         return False
+    # Rehash passwords stored with an outdated cost factor
+    if new_hashed_password:
+        await async_database.update_hashed_password(emailAddress, new_hashed_password)
     return user
 
 
 @router.post("/signup", tags=["auth"], status_code=status.HTTP_201_CREATED)
-def sign_up(user: UserCreate):
+async def sign_up(user: UserCreate):
     # Check if user already exists in the database
-    if database.user_exists(user.emailAddress):
+    if await async_database.user_exists(user.emailAddress):
         raise HTTPException(status_code=400, detail="User already registered")
 
     # If user does not exist, add user to the database
-    database.create_user(user)
+    hashed_password = await hash_password(user.password)
+    await async_database.create_user(user.emailAddress, hashed_password)
 
     return {"message": "User registered successfully"}
 
 
 @router.post("/login", tags=["auth"])
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
 
@@ -62,45 +67,68 @@ def protected_route(current_user: User = Depends(get_current_user)):
 
 
 @router.post("/plant", tags=["profile"])
-def plant_tree(advertisement_id: str, current_user: User = Depends(get_current_user)):
-    advertisement = ad_db.get_advertisement(advertisement_id)
-    if advertisement is None:
-        raise HTTPException(status_code=400, detail="No such advertisement exists")
-    if advertisement["closed"]:
-        raise HTTPException(status_code=400, detail="No more coupons available")
-    trees_per_click = advertisement.get("trees_per_click", 1)
-    # Check if user already has a coupon
-    exists = coupon_db.check_if_user_already_has_coupon(
-        advertisement_id, current_user.emailAddress
+def plant_tree(
+    advertisement_id: str,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+):
+    # Claim a coupon and plant the trees in a single transaction
+    try:
+        result = plant_db.plant_tree(advertisement_id, current_user.emailAddress)
+    except plant_db.PlantError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    response.headers["Server-Timing"] = ", ".join(
+        f"{step};dur={duration}" for step, duration in result["timings_ms"].items()
     )
-    if exists:
-        raise HTTPException(
-            status_code=400, detail="User already has a coupon for this advertisement"
-        )
-    # Select a random coupon code for the user and mark it as used
-    coupon_code = coupon_db.select_random_coupon_code(advertisement_id)
-    if not coupon_code:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="No available coupon codes for the advertisement",
-        )
-    coupon_db.mark_coupon_code_as_used(
-        advertisement_id, coupon_code, current_user.emailAddress
+    return {
+        "message": "Trees planted successfully",
+        "coupon": result["coupon"],
+        "trees_planted": result["trees_planted"],
+        "timings_ms": result["timings_ms"],
+    }
+
+
+def _get_profile_etag(user: dict, coupons_limit: int):
+    return (
+        f'"{user.get("trees_planted", 0)}-{user.get("coupons_claimed", 0)}'
+        f'-{coupons_limit}"'
     )
-    ad_db.increase_trees_planted_in_advertisement(advertisement_id, trees_per_click)
-    database.plant_tree(current_user.emailAddress, trees_per_click)
-    return {"message": "Trees planted successfully"}
 
 
 @router.get("/profile", tags=["profile"])
-def get_profile(current_user: User = Depends(get_current_user)):
-    num_of_trees = database.get_num_of_trees(current_user.emailAddress)
+def get_profile(
+    request: Request,
+    response: Response,
+    coupons_limit: int = Query(PROFILE_COUPONS_LIMIT, ge=0, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+):
+    headers = {"Cache-Control": "private, no-cache"}
+
+    # Polling clients are answered from the counters alone while nothing changed
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        version = database.get_profile_version(current_user.emailAddress)
+        etag = _get_profile_etag(version, coupons_limit)
+        if etag_matches(if_none_match, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={**headers, "ETag": etag},
+            )
+
+    user = database.get_profile(current_user.emailAddress, coupons_limit)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    response.headers.update({**headers, "ETag": _get_profile_etag(user, coupons_limit)})
+
+    num_of_trees = user["trees_planted"]
     carbon_credit = num_of_trees * 22
-    user_coupons = coupon_db.get_user_coupons(current_user.emailAddress)
     profile = {
         "num_of_trees": num_of_trees,
         "carbon_credit": carbon_credit,
         "email_address": current_user.emailAddress,
-        "user_coupons": user_coupons,
+        "user_coupons": user["coupons"],
     }
     return profile
@@ -0,0 +1,20 @@
+# async_coupon_db.py
+from app.utils.mongo import get_async_db
+
+
+async def get_user_coupon_advertisement_ids(email_address: str):
+    advertisement_ids = await get_async_db().coupons.distinct(
+        "advertisement_id", {"user_email": email_address}
+    )
+    return set(advertisement_ids)
+
+
+async def count_coupons(advertisement_id: str):
+    # Total and unclaimed coupons, for advertisements without inventory
+    # counters
+    coupons = get_async_db().coupons
+    total = await coupons.count_documents({"advertisement_id": advertisement_id})
+    remaining = await coupons.count_documents(
+        {"advertisement_id": advertisement_id, "user_email": {"$exists": False}}
+    )
+    return total, remaining
@@ -0,0 +1,35 @@
+# async_database.py
+from app.auth.models.user import User
+from app.utils.cache import invalidate_principal
+from app.utils.mongo import get_async_db
+
+
+async def get_user(email_address: str):
+    user_data = await get_async_db().users.find_one({"emailAddress": email_address})
+    if user_data:
+        return User(**user_data)
+    return None
+
+
+async def user_exists(email_address: str):
+    user_data = await get_async_db().users.find_one(
+        {"emailAddress": email_address}, {"_id": 1}
+    )
+    return user_data is not None
+
+
+# Writes that change fields of the User model must invalidate the principal
+# cache so authenticated requests do not keep seeing the old user
+async def create_user(email_address: str, hashed_password: str):
+    await get_async_db().users.insert_one(
+        {"emailAddress": email_address, "hashed_password": hashed_password}
+    )
+    invalidate_principal(email_address)
+
+
+async def update_hashed_password(email_address: str, hashed_password: str):
+    await get_async_db().users.update_one(
+        {"emailAddress": email_address},
+        {"$set": {"hashed_password": hashed_password}},
+    )
+    invalidate_principal(email_address)
@@ -1,73 +1,143 @@
 # database.py
-import os
+import datetime
 import random
 
-from pymongo import MongoClient
-from typing import List
-from passlib.context import CryptContext
+from pymongo import ReturnDocument, ReplaceOne, ASCENDING, DESCENDING
 from app.advertisement.service import database as ad_db
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["dev"]
-
-
-def select_random_coupon_code(advertisement_id: str):
-    # Retrieve all available coupon codes for the advertisement
-    advertisement_coupons = list(
-        db.coupons.find(
-            {"advertisement_id": advertisement_id, "user_email": {"$exists": False}}
+from app.utils.counters import counters
+from app.utils.mongo import get_db
+
+
+def claim_random_coupon_code(advertisement_id: str, email_address: str, session=None):
+    # Every coupon carries a uniform random key, so picking the first unclaimed
+    # coupon at or after a random point is a uniform pick that the server can
+    # answer from the index and assign to the user in a single atomic update.
+    # Coupons stored before the random key existed are handed out last.
+    pivot = random.random()
+    for random_filter, direction in (
+        ({"$gte": pivot}, ASCENDING),
+        ({"$lt": pivot}, DESCENDING),
+        ({"$exists": False}, ASCENDING),
+    ):
+        coupon = get_db().coupons.find_one_and_update(
+            {
+                "advertisement_id": advertisement_id,
+                "user_email": {"$exists": False},
+                "random": random_filter,
+            },
+            {
+                "$set": {
+                    "user_email": email_address,
+                    "claimed_at": datetime.datetime.utcnow(),
+                }
+            },
+            sort=[("random", direction)],
+            projection={"_id": 0, "random": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session,
         )
-    )
-    coupon_codes = [coupon["code"] for coupon in advertisement_coupons]
-
-    # Select a random coupon code
-    if coupon_codes:
-        return random.choice(coupon_codes)
-    else:
-        return None
+        if coupon:
+            return coupon
+    return None
 
 
-def mark_coupon_code_as_used(
-    advertisement_id: str, coupon_code: str, email_address: str
-):
-    db.coupons.update_one(
-        {"advertisement_id": advertisement_id, "code": coupon_code},
-        {"$set": {"user_email": email_address}},
+def has_coupon(advertisement_id: str, email_address: str, session=None):
+    coupon = get_db().coupons.find_one(
+        {"user_email": email_address, "advertisement_id": advertisement_id},
+        {"_id": 1},
+        session=session,
     )
-    # Check if the coupon was the last remaining one for the advertisement
-    remaining_coupons = db.coupons.count_documents(
-        {"advertisement_id": advertisement_id, "user_email": {"$exists": False}}
-    )
-    if remaining_coupons == 0:
-        # Update advertisement to mark it as closed
-        ad_db.close_advertisement(advertisement_id)
-
+    return coupon is not None
 
-def get_user_coupons(email_address: str):
-    coupons = list(db.coupons.find({"user_email": email_address}, {"_id": 0}))
-    return coupons
 
-
-def add_coupon(coupon: dict):
-    db.coupons.insert_one(coupon)
+def has_unclaimed_coupon(advertisement_id: str, session=None):
+    coupon = get_db().coupons.find_one(
+        {"advertisement_id": advertisement_id, "user_email": {"$exists": False}},
+        {"_id": 1},
+        session=session,
+    )
+    return coupon is not None
 
 
-def get_ad_coupons(advertisement_id: str):
-    coupons = list(db.coupons.find({"advertisement_id": advertisement_id}))
-    return coupons
+def close_advertisement_if_out_of_coupons(advertisement_id: str, session=None):
+    # Only reads on every click, so concurrent clicks do not conflict on the
+    # advertisement document. Concurrent claims of the last coupons can each
+    # still see the other's coupon, the next click then finds none and
+    # closes the advertisement.
+    if has_unclaimed_coupon(advertisement_id, session=session):
+        return False
+    ad_db.close_advertisement(advertisement_id, session=session)
+    return True
 
 
-def add_coupons(coupons: List[dict]):
-    db.coupons.insert_many(coupons)
+def count_claimed_coupon(advertisement: dict):
+    # With write-behind the inventory counter is buffered and written in
+    # bulk, advertisements without counters are left to
+    # repair_coupon_inventory
+    if "coupons_remaining" in advertisement:
+        counters.increment(
+            "advertisements", {"_id": advertisement["_id"]}, "coupons_remaining", -1
+        )
 
 
-def check_if_user_already_has_coupon(advertisement_id: str, email_address):
-    coupon = db.coupons.find_one(
-        {"advertisement_id": advertisement_id, "user_email": email_address}
+def archive_duplicate_coupons():
+    # Moves the coupons that keep the unique coupon indexes from being built
+    # to duplicate_coupons: the extra claims of a user on an advertisement,
+    # keeping the first, and the extra copies of a code, keeping claimed
+    # copies first. A code claimed by two users stays with the first of them.
+    # Returns the ids of the advertisements that lost coupons.
+    coupons = get_db().coupons
+    duplicate_ids = []
+    claims = coupons.aggregate(
+        [
+            {"$match": {"user_email": {"$type": "string"}}},
+            {"$sort": {"_id": ASCENDING}},
+            {
+                "$group": {
+                    "_id": {
+                        "advertisement_id": "$advertisement_id",
+                        "user_email": "$user_email",
+                    },
+                    "ids": {"$push": "$_id"},
+                }
+            },
+            {"$match": {"ids.1": {"$exists": True}}},
+        ]
     )
-    if coupon:
-        return True
-    else:
-        return False
+    for claim in claims:
+        duplicate_ids += claim["ids"][1:]
+    codes = coupons.aggregate(
+        [
+            {"$match": {"code": {"$exists": True}}},
+            {"$sort": {"_id": ASCENDING}},
+            {
+                "$group": {
+                    "_id": {"advertisement_id": "$advertisement_id", "code": "$code"},
+                    "copies": {
+                        "$push": {
+                            "_id": "$_id",
+                            "claimed": {"$ifNull": ["$user_email", False]},
+                        }
+                    },
+                }
+            },
+            {"$match": {"copies.1": {"$exists": True}}},
+        ]
+    )
+    for code in codes:
+        copies = sorted(code["copies"], key=lambda copy: not copy["claimed"])
+        duplicate_ids += [copy["_id"] for copy in copies[1:]]
+    duplicate_ids = list(set(duplicate_ids))
+    if not duplicate_ids:
+        return []
+
+    duplicates = list(coupons.find({"_id": {"$in": duplicate_ids}}))
+    # Replacing by _id keeps the archive correct when a run is repeated
+    get_db().duplicate_coupons.bulk_write(
+        [
+            ReplaceOne({"_id": coupon["_id"]}, coupon, upsert=True)
+            for coupon in duplicates
+        ]
+    )
+    coupons.delete_many({"_id": {"$in": duplicate_ids}})
+    return sorted({coupon["advertisement_id"] for coupon in duplicates})
@@ -0,0 +1,154 @@
+# coupon_ingest.py
+import codecs
+import csv
+import datetime
+import itertools
+import logging
+import os
+import random
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.advertisement.service import database as ad_db
+from app.utils.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+COUPON_INSERT_BATCH_SIZE = int(os.getenv("COUPON_INSERT_BATCH_SIZE", "5000"))
+
+DUPLICATE_KEY_ERROR = 11000
+_header_names = {"code", "coupon_code", "coupon"}
+
+
+def read_coupon_codes(binary_file):
+    # Yields the codes of a text file with one code per line, or of the first
+    # column of a CSV file, without reading the whole file into memory
+    rows = csv.reader(codecs.iterdecode(binary_file, "utf-8-sig"))
+    for line_number, row in enumerate(rows):
+        if not row:
+            continue
+        code = row[0].strip()
+        if not code or (line_number == 0 and code.lower() in _header_names):
+            continue
+        yield code
+
+
+def _chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _insert_chunk(advertisement_id: str, codes: list):
+    # Returns how many of the codes were inserted. With ordered=False the
+    # server keeps going past duplicates and reports them all at the end.
+    coupons = [
+        {"advertisement_id": advertisement_id, "code": code, "random": random.random()}
+        for code in codes
+    ]
+    try:
+        get_db().coupons.insert_many(coupons, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        return len(coupons) - len(errors)
+    return len(coupons)
+
+
+def ingest_coupon_codes(
+    advertisement_id: str,
+    codes,
+    on_progress=None,
+    batch_size: int = COUPON_INSERT_BATCH_SIZE,
+):
+    # Adds any iterable of codes to the advertisement in batches. Codes the
+    # advertisement already has are rejected by the unique
+    # (advertisement_id, code) index instead of being looked up beforehand.
+    if not ad_db.increase_coupon_inventory(advertisement_id, 0):
+        ad_db.repair_coupon_inventory(advertisement_id)
+    accepted = duplicates = 0
+    try:
+        for chunk in _chunked(codes, batch_size):
+            # The inventory is raised before the insert so that a concurrent
+            # claim can never count it down to zero and close the
+            # advertisement, then corrected by the rejected duplicates
+            ad_db.increase_coupon_inventory(advertisement_id, len(chunk))
+            chunk_accepted = _insert_chunk(advertisement_id, chunk)
+            if chunk_accepted < len(chunk):
+                ad_db.increase_coupon_inventory(
+                    advertisement_id, chunk_accepted - len(chunk)
+                )
+            accepted += chunk_accepted
+            duplicates += len(chunk) - chunk_accepted
+            if on_progress is not None:
+                on_progress(accepted, duplicates)
+    except Exception:
+        # The counters are off by whatever the failed batch did
+        ad_db.repair_coupon_inventory(advertisement_id)
+        raise
+    return {"accepted": accepted, "duplicates": duplicates}
+
+
+def create_job(advertisement_id: str, created_by: str, size: int):
+    # Uploads are ingested in the background, progress is kept in
+    # coupon_jobs so that any worker can answer the polling requests
+    result = get_db().coupon_jobs.insert_one(
+        {
+            "advertisement_id": advertisement_id,
+            "created_by": created_by,
+            "status": "pending",
+            "accepted": 0,
+            "duplicates": 0,
+            "bytes_read": 0,
+            "bytes_total": size,
+            "error": None,
+            "created_at": datetime.datetime.utcnow(),
+        }
+    )
+    return str(result.inserted_id)
+
+
+def get_job(job_id: str):
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = get_db().coupon_jobs.find_one({"_id": ObjectId(job_id)})
+    return job
+
+
+def run_job(job_id: str, file_path: str):
+    # Ingests the uploaded file of a job and deletes it afterwards
+    jobs = get_db().coupon_jobs
+    job_filter = {"_id": ObjectId(job_id)}
+    job = jobs.find_one_and_update(job_filter, {"$set": {"status": "running"}})
+    try:
+        with open(file_path, "rb") as f:
+
+            def on_progress(accepted, duplicates):
+                jobs.update_one(
+                    job_filter,
+                    {
+                        "$set": {
+                            "accepted": accepted,
+                            "duplicates": duplicates,
+                            "bytes_read": f.tell(),
+                        }
+                    },
+                )
+
+            result = ingest_coupon_codes(
+                job["advertisement_id"], read_coupon_codes(f), on_progress
+            )
+    except Exception as e:
+        logger.exception("Coupon upload %s failed", job_id)
+        update = {"status": "failed", "error": str(e)}
+    else:
+        update = {"status": "done", "bytes_read": job["bytes_total"], **result}
+    finally:
+        os.remove(file_path)
+    update["finished_at"] = datetime.datetime.utcnow()
+    jobs.update_one(job_filter, {"$set": update})
@@ -1,41 +1,72 @@
 # database.py
-import os
 
-from pymongo import MongoClient
-from app.auth.models.user import UserCreate, User
-from passlib.context import CryptContext
+from app.utils.counters import counters
+from app.utils.mongo import get_db
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["dev"]
-
-
-def get_user(email_address: str):
-    user_data = db.users.find_one({"emailAddress": email_address})
-    if user_data:
-        return User(**user_data)
-    return None
-
-
-def create_user(user: UserCreate):
-    hashed_password = pwd_context.hash(user.password)
-    db.users.insert_one(
-        {"emailAddress": user.emailAddress, "hashed_password": hashed_password}
+def plant_tree(email_address: str, num_of_tree: int, session=None):
+    # Every plant claims one coupon, coupons_claimed versions the coupon list
+    get_db().users.update_one(
+        {"emailAddress": email_address},
+        {"$inc": {"trees_planted": num_of_tree, "coupons_claimed": 1}},
+        session=session,
     )
 
 
-def user_exists(email_address: str):
-    return db.users.find_one({"emailAddress": email_address}) is not None
+def _add_pending_counters(user: dict, email_address: str):
+    # Include counts of this worker not yet written by the counter aggregator
+    for field in ("trees_planted", "coupons_claimed"):
+        user[field] = user.get(field, 0) + counters.pending(
+            "users", {"emailAddress": email_address}, field
+        )
+    return user
 
 
-def plant_tree(email_address: str, num_of_tree: int):
-    db.users.update_one(
-        {"emailAddress": email_address}, {"$inc": {"trees_planted": num_of_tree}}
+def get_profile_version(email_address: str):
+    # The profile only changes when the user plants, so the counters are
+    # enough to answer conditional requests
+    user = get_db().users.find_one(
+        {"emailAddress": email_address},
+        {"_id": 0, "trees_planted": 1, "coupons_claimed": 1},
     )
+    return _add_pending_counters(user or {}, email_address)
 
 
-def get_num_of_trees(email_address: str):
-    user = db.users.find_one({"emailAddress": email_address})
-    num_of_trees = user.get("trees_planted", 0)
-    return num_of_trees
+def get_profile(email_address: str, coupons_limit: int):
+    # The user with their most recently claimed coupons in one round trip.
+    # Claims made before claimed_at was recorded come last.
+    profiles = get_db().users.aggregate(
+        [
+            {"$match": {"emailAddress": email_address}},
+            {"$limit": 1},
+            {
+                "$lookup": {
+                    "from": "coupons",
+                    "let": {"email_address": "$emailAddress"},
+                    "pipeline": [
+                        {
+                            "$match": {
+                                "$expr": {"$eq": ["$user_email", "$$email_address"]}
+                            }
+                        },
+                        {"$sort": {"claimed_at": -1, "_id": -1}},
+                        {"$limit": coupons_limit},
+                        {"$project": {"_id": 0, "random": 0}},
+                    ],
+                    "as": "coupons",
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "trees_planted": 1,
+                    "coupons_claimed": 1,
+                    "coupons": 1,
+                }
+            },
+        ]
+    )
+    profile = next(profiles, None)
+    if profile is None:
+        return None
+    return _add_pending_counters(profile, email_address)
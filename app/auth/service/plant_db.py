@@ -0,0 +1,141 @@
+# plant_db.py
+import os
+import time
+from contextlib import contextmanager
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
+from app.advertisement.service import analytics, database as ad_db
+from app.advertisement.service.feed_cache import feed_cache
+from app.auth.service import coupon_db, database
+from app.leaderboard.service.leaderboards import leaderboards
+from app.utils.counters import TREES_WRITE_BEHIND, counters
+from app.utils.mongo import get_client
+
+# Transactions need a replica set, standalone development servers can turn
+# them off and accept that a crash midway leaves the counters inconsistent
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "true").lower() == "true"
+
+
+class PlantError(Exception):
+    pass
+
+
+class OutOfCouponsError(PlantError):
+    pass
+
+
+@contextmanager
+def _timed(timings: dict, step: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[step] = round((time.perf_counter() - start) * 1000, 3)
+
+
+def _plant(advertisement_id: str, email_address: str, timings: dict, session):
+    # Timings of an aborted attempt are discarded when the transaction retries
+    timings.clear()
+    with _timed(timings, "advertisement"):
+        try:
+            advertisement = ad_db.get_advertisement(advertisement_id, session=session)
+        except InvalidId:
+            advertisement = None
+    if advertisement is None:
+        raise PlantError("No such advertisement exists")
+    if advertisement["closed"]:
+        raise PlantError("No more coupons available")
+    trees_per_click = advertisement.get("trees_per_click", 1)
+
+    # Repeated clicks are caught here, the unique (user_email,
+    # advertisement_id) index rejects concurrent ones
+    with _timed(timings, "owned"):
+        if coupon_db.has_coupon(advertisement_id, email_address, session=session):
+            raise PlantError("User already has a coupon for this advertisement")
+    with _timed(timings, "claim"):
+        try:
+            coupon = coupon_db.claim_random_coupon_code(
+                advertisement_id, email_address, session=session
+            )
+        except DuplicateKeyError:
+            raise PlantError("User already has a coupon for this advertisement")
+    if not coupon:
+        raise OutOfCouponsError("No available coupon codes for the advertisement")
+
+    # With write-behind the tree and inventory counters are credited after
+    # the commit. Advertisements without an inventory counter are left to
+    # repair_coupon_inventory.
+    if not TREES_WRITE_BEHIND:
+        with _timed(timings, "advertisement_trees"):
+            ad_db.increase_trees_planted_in_advertisement(
+                advertisement_id,
+                trees_per_click,
+                coupons_claimed=int("coupons_remaining" in advertisement),
+                session=session,
+            )
+        with _timed(timings, "user_trees"):
+            database.plant_tree(email_address, trees_per_click, session=session)
+    with _timed(timings, "close"):
+        closed = coupon_db.close_advertisement_if_out_of_coupons(
+            advertisement_id, session=session
+        )
+    return {
+        "coupon": coupon,
+        "trees_planted": trees_per_click,
+        "closed": closed,
+        "advertiser": advertisement.get("created_by"),
+        "ngo": advertisement.get("ngo"),
+        "advertisement": advertisement,
+    }
+
+
+def plant_tree(advertisement_id: str, email_address: str):
+    # Claims a coupon and credits the trees to the advertisement and the user
+    # as one atomic operation. Raises PlantError when nothing can be planted.
+    timings = {}
+    start = time.perf_counter()
+    try:
+        if MONGO_TRANSACTIONS:
+            with get_client().start_session() as session:
+                result = session.with_transaction(
+                    lambda session: _plant(
+                        advertisement_id, email_address, timings, session
+                    )
+                )
+        else:
+            result = _plant(advertisement_id, email_address, timings, None)
+    except OutOfCouponsError:
+        # Closed outside the aborted transaction, the last claims raced past
+        # the check in _plant
+        ad_db.close_advertisement(advertisement_id)
+        feed_cache.invalidate()
+        raise
+    advertisement = result.pop("advertisement")
+    if TREES_WRITE_BEHIND:
+        coupon_db.count_claimed_coupon(advertisement)
+        counters.increment(
+            "advertisements",
+            {"_id": ObjectId(advertisement_id)},
+            "trees_planted",
+            result["trees_planted"],
+        )
+        counters.increment(
+            "users",
+            {"emailAddress": email_address},
+            "trees_planted",
+            result["trees_planted"],
+        )
+        counters.increment("users", {"emailAddress": email_address}, "coupons_claimed")
+    analytics.record_click(advertisement_id, result["trees_planted"])
+    leaderboards.record_plant(
+        email_address, result["advertiser"], result["ngo"], result["trees_planted"]
+    )
+    timings["total"] = round((time.perf_counter() - start) * 1000, 3)
+
+    # Only drop the cached feed once the close is visible to other readers
+    if result["closed"]:
+        feed_cache.invalidate()
+    result["timings_ms"] = timings
+    return result
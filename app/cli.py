@@ -0,0 +1,97 @@
+"""
+Maintenance commands, run with `python -m app.cli <command>`
+"""
+
+import argparse
+import sys
+
+from app.advertisement.service import database as ad_db
+from app.auth.service import coupon_db
+from app.leaderboard.service import database as leaderboard_db
+from app.utils import indexes
+from app.utils.mongo import get_db
+
+
+def ensure_indexes(args):
+    db = get_db()
+    failed = indexes.ensure_indexes(db)
+    for collection_name, name in failed:
+        print(f"failed: {collection_name}.{name}")
+    missing = indexes.get_missing_indexes(db)
+    for collection_name, name in missing:
+        print(f"missing: {collection_name}.{name}")
+    if args.report:
+        for collection_name, name in indexes.get_unused_indexes(db):
+            print(f"unused: {collection_name}.{name}")
+        for collection_name, query in indexes.get_unindexed_hot_queries(db):
+            print(f"not index backed: {collection_name} {query}")
+    return 1 if failed or missing else 0
+
+
+def repair_inventory(args):
+    repaired = ad_db.repair_coupon_inventory(args.advertisement_id)
+    print(f"recomputed the inventory of {repaired} advertisements with coupons")
+    return 0
+
+
+def dedupe_coupons(args):
+    advertisement_ids = coupon_db.archive_duplicate_coupons()
+    for advertisement_id in advertisement_ids:
+        ad_db.repair_coupon_inventory(advertisement_id)
+    print(
+        f"moved duplicate coupons of {len(advertisement_ids)} advertisements "
+        "to duplicate_coupons"
+    )
+    return 0
+
+
+def rebuild_leaderboards(args):
+    members = leaderboard_db.rebuild_scores()
+    for board, count in members.items():
+        print(f"{board}: {count} members")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    indexes_parser = subparsers.add_parser(
+        "indexes", help="Create missing indexes and report on index usage"
+    )
+    indexes_parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Also list unused indexes and hot queries that are not index backed",
+    )
+    indexes_parser.set_defaults(func=ensure_indexes)
+
+    inventory_parser = subparsers.add_parser(
+        "repair-inventory",
+        help="Recompute advertisement coupon counters from the coupons collection",
+    )
+    inventory_parser.add_argument(
+        "--advertisement-id", help="Only repair this advertisement"
+    )
+    inventory_parser.set_defaults(func=repair_inventory)
+
+    dedupe_parser = subparsers.add_parser(
+        "dedupe-coupons",
+        help="Move duplicate claims and codes out of the coupons collection so "
+        "that its unique indexes can be built, run it while the app is stopped",
+    )
+    dedupe_parser.set_defaults(func=dedupe_coupons)
+
+    leaderboards_parser = subparsers.add_parser(
+        "rebuild-leaderboards",
+        help="Recompute the leaderboards from the tree counters, the workers "
+        "pick the new scores up on their next refresh",
+    )
+    leaderboards_parser.set_defaults(func=rebuild_leaderboards)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
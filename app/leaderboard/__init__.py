@@ -0,0 +1 @@
+from .endpoints import router  # type: ignore  # noqa: F401
@@ -0,0 +1 @@
+from .leaderboard import router  # type: ignore  # noqa: F401
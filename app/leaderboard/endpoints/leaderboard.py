@@ -0,0 +1,44 @@
+from enum import Enum
+
+from fastapi import APIRouter, Depends, Query
+
+from app.auth.models.user import User
+from app.leaderboard.service.leaderboards import LEADERBOARD_SIZE, leaderboards
+from app.utils.utils import get_current_user
+
+router = APIRouter()
+
+
+class BoardEnum(str, Enum):
+    users = "users"
+    advertisers = "advertisers"
+    ngos = "ngos"
+
+
+def _mask_email(member: str):
+    # Other users only see the first two characters of an email address
+    name, at, domain = member.partition("@")
+    if not at:
+        return member
+    return f"{name[:2]}***@{domain}"
+
+
+@router.get("/{board}", tags=["leaderboard"])
+def get_leaderboard(
+    board: BoardEnum,
+    limit: int = Query(10, ge=1, le=LEADERBOARD_SIZE),
+    current_user: User = Depends(get_current_user),
+):
+    leaderboard = leaderboards.boards[board.value]
+    top = leaderboard.get_top(limit)
+    if board != BoardEnum.ngos:
+        for entry in top:
+            if entry["member"] != current_user.emailAddress:
+                entry["member"] = _mask_email(entry["member"])
+    return {
+        "board": board.value,
+        "members": len(leaderboard),
+        "top": top,
+        # The current user's own position, None if they are not on the board
+        "me": leaderboard.get_rank(current_user.emailAddress),
+    }
@@ -0,0 +1,81 @@
+# database.py
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.utils.counters import counters
+from app.utils.mongo import get_db
+
+BOARDS = ("users", "advertisers", "ngos")
+
+
+def increment_score(board: str, member: str, amount: int):
+    # Buffered and written in bulk by the counter aggregator
+    counters.increment(
+        "leaderboard_scores",
+        {"board": board, "member": member},
+        "score",
+        amount,
+        upsert=True,
+    )
+
+
+def get_pending_scores():
+    # (board, member, amount) of the increments not yet written
+    return [
+        (score_filter["board"], score_filter["member"], fields["score"])
+        for score_filter, fields in counters.get_pending("leaderboard_scores")
+    ]
+
+
+def get_scores(board: str):
+    scores = get_db().leaderboard_scores.find(
+        {"board": board}, {"_id": 0, "member": 1, "score": 1}
+    )
+    return {score["member"]: score["score"] for score in scores}
+
+
+def _compute_scores():
+    db = get_db()
+    scores = {
+        "users": {
+            user["emailAddress"]: user["trees_planted"]
+            for user in db.users.find(
+                {"trees_planted": {"$gt": 0}},
+                {"_id": 0, "emailAddress": 1, "trees_planted": 1},
+            )
+        }
+    }
+    for board, field in (("advertisers", "$created_by"), ("ngos", "$ngo")):
+        totals = db.advertisements.aggregate(
+            [
+                {"$match": {"trees_planted": {"$gt": 0}}},
+                {"$group": {"_id": field, "score": {"$sum": "$trees_planted"}}},
+            ]
+        )
+        scores[board] = {
+            total["_id"]: total["score"] for total in totals if total["_id"]
+        }
+    return scores
+
+
+def rebuild_scores():
+    # Recomputes every leaderboard from the tree counters of the users and
+    # advertisements. Plants buffered by running workers while this runs can
+    # be counted twice, run it while the app is stopped for exact scores.
+    collection = get_db().leaderboard_scores
+    scores = _compute_scores()
+    # Members that were not written by this rebuild are deleted afterwards
+    rebuild_id = ObjectId()
+    for board, board_scores in scores.items():
+        operations = [
+            UpdateOne(
+                {"board": board, "member": member},
+                {"$set": {"score": score, "rebuild_id": rebuild_id}},
+                upsert=True,
+            )
+            for member, score in board_scores.items()
+        ]
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+    collection.delete_many({"rebuild_id": {"$ne": rebuild_id}})
+    return {board: len(board_scores) for board, board_scores in scores.items()}
@@ -0,0 +1,130 @@
+# leaderboards.py
+import logging
+import os
+import threading
+
+from pymongo.errors import PyMongoError
+from sortedcontainers import SortedList
+
+from app.leaderboard.service import database
+from app.utils.counters import counters
+
+logger = logging.getLogger(__name__)
+
+# How often every worker reloads the boards to pick up the plants handled by
+# the other workers
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "60"))
+# Number of top entries that can be requested
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "100"))
+
+
+class Leaderboard:
+    # Every member's score plus a sorted list of (-score, member), so the
+    # rank of any member is one binary search away. SortedList keeps the
+    # updates of a plant O(log n), a plain list would move every entry
+    # after the updated one.
+
+    def __init__(self):
+        self._scores = {}
+        self._ranking = SortedList()
+        self._lock = threading.Lock()
+
+    def load(self, scores: dict):
+        ranking = SortedList((-score, member) for member, score in scores.items())
+        with self._lock:
+            self._scores = dict(scores)
+            self._ranking = ranking
+
+    def increment(self, member: str, amount: int):
+        with self._lock:
+            score = self._scores.get(member)
+            if score is not None:
+                self._ranking.remove((-score, member))
+            score = (score or 0) + amount
+            self._scores[member] = score
+            self._ranking.add((-score, member))
+
+    def _get_rank(self, score: int):
+        # Members with the same score share the rank, (-score,) sorts before
+        # every (-score, member) entry
+        return self._ranking.bisect_left((-score,)) + 1
+
+    def get_rank(self, member: str):
+        with self._lock:
+            score = self._scores.get(member)
+            if score is None:
+                return None
+            return {"rank": self._get_rank(score), "score": score}
+
+    def get_top(self, limit: int):
+        with self._lock:
+            return [
+                {"rank": self._get_rank(-score), "member": member, "score": -score}
+                for score, member in self._ranking.islice(0, limit)
+            ]
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class Leaderboards:
+    # The boards of this worker, updated in memory on every plant and
+    # reloaded from the leaderboard_scores collection in the background
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.boards = {board: Leaderboard() for board in database.BOARDS}
+        # Held while a plant is recorded and while reloaded boards take over
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record_plant(self, email_address: str, advertiser: str, ngo: str, trees: int):
+        with self._lock:
+            for board, member in (
+                ("users", email_address),
+                ("advertisers", advertiser),
+                ("ngos", ngo),
+            ):
+                if member:
+                    self.boards[board].increment(member, trees)
+                    database.increment_score(board, member, trees)
+
+    def refresh(self):
+        # Flushes wait while the scores are read, so every increment of this
+        # worker is either in the database or still pending. Plants wait
+        # while the pending ones are added and the new boards take over.
+        with counters.paused():
+            boards = {}
+            for board in database.BOARDS:
+                boards[board] = Leaderboard()
+                boards[board].load(database.get_scores(board))
+            with self._lock:
+                for board, member, amount in database.get_pending_scores():
+                    boards[board].increment(member, amount)
+                self.boards = boards
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except PyMongoError:
+                logger.exception("Could not refresh the leaderboards")
+            if self._stopped.wait(self.refresh_interval):
+                return
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="leaderboard-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+leaderboards = Leaderboards(LEADERBOARD_REFRESH_SECONDS)
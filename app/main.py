@@ -2,13 +2,27 @@
 GuROOM backend main.py
 """
 
-import uvicorn
+import logging
 import os
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import APIRouter, Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from app import router as apps_router
+from app.utils.pagination import NEXT_CURSOR_HEADER
+from app.utils import indexes, mail, metrics, mongo, query_trace, rate_limit
+from app.advertisement.service.feed_cache import feed_cache
+from app.utils.cache import principal_cache
+from app.leaderboard.service.leaderboards import leaderboards
+from app.utils.counters import counters
+from app.utils.utils import require_internal
+
+logger = logging.getLogger(__name__)
 
 tags_metadata = [
     {
@@ -20,9 +34,56 @@ tags_metadata = [
         "description": "Operations with registering advertisement",
     },
     {"name": "advertisements", "description": "Operations with advertisements"},
+    {"name": "leaderboard", "description": "Tree planting leaderboards"},
 ]
-app = FastAPI(openapi_tags=tags_metadata)
+
+
+def connect_to_mongo():
+    mongo.get_client()
+    # Index creation is idempotent, so every worker can safely run it
+    if os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true":
+        indexes.ensure_indexes(mongo.get_db())
+    indexes.check_required_indexes(mongo.get_db())
+
+
+def close_mongo_connection():
+    mongo.close_client()
+    mongo.close_async_client()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connections, threads and tasks are only created here, in the worker
+    # process, never at import time. Under gunicorn with preload_app the
+    # import happens in the master before the workers are forked.
+
+    # The server records when it forked the worker, so that the cold start
+    # includes importing the app unless it was preloaded
+    started_at = float(os.getenv("SERVER_WORKER_FORKED_AT", time.time()))
+    counters.start()
+    await run_in_threadpool(connect_to_mongo)
+    mail.start_worker()
+    leaderboards.start()
+
+    cold_start = time.time() - started_at
+    metrics.COLD_START.labels(str("SERVER_APP_PRELOADED" in os.environ).lower()).set(
+        cold_start
+    )
+    logger.info("Worker %s ready in %.0fms", os.getpid(), cold_start * 1000)
+    try:
+        yield
+    finally:
+        await run_in_threadpool(leaderboards.stop)
+        await mail.stop_worker()
+        # Buffered counters are written while the client is still open
+        await run_in_threadpool(counters.stop)
+        close_mongo_connection()
+
+
+app = FastAPI(openapi_tags=tags_metadata, lifespan=lifespan)
 app.include_router(apps_router, prefix="/apps")
+app.add_middleware(query_trace.QueryTraceMiddleware)
+app.add_middleware(rate_limit.RateLimitMiddleware)
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SECRET_KEY"))
 app.add_middleware(
     CORSMiddleware,
@@ -34,7 +95,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
+# Outermost, so rejected and failed requests are measured as well
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.get("/")
@@ -42,6 +106,41 @@ async def test():
     return JSONResponse({"message": "test"})
 
 
+# Stats of the running worker, kept off the public port
+internal_router = APIRouter(
+    dependencies=[Depends(require_internal)], include_in_schema=False
+)
+
+
+@internal_router.get("/metrics")
+def get_metrics():
+    content, content_type = metrics.generate_metrics()
+    return Response(content, media_type=content_type)
+
+
+@internal_router.get("/mongo/pool")
+async def get_mongo_pool_stats():
+    return JSONResponse(mongo.get_pool_stats())
+
+
+@internal_router.get("/cache/principals")
+async def get_principal_cache_stats():
+    return JSONResponse(principal_cache.stats())
+
+
+@internal_router.get("/cache/feed")
+async def get_feed_cache_stats():
+    return JSONResponse(feed_cache.stats())
+
+
+@internal_router.get("/rate-limit")
+async def get_rate_limit_stats():
+    return JSONResponse(rate_limit.get_stats())
+
+
+app.include_router(internal_router)
+
+
 def run():
     uvicorn.run(app)
 
@@ -0,0 +1,33 @@
+"""
+Production server, run with `python -m app.server`
+
+Runs the app in preforked gunicorn workers configured by gunicorn.conf.py,
+further gunicorn options can be passed on the command line.
+"""
+
+import os
+import sys
+
+from uvicorn.workers import UvicornWorker
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py"
+)
+
+
+class Worker(UvicornWorker):
+    # uvloop and httptools are part of uvicorn[standard], fail loudly instead
+    # of silently falling back to asyncio and h11 if they are missing. The
+    # worker does not accept requests until the lifespan startup completed.
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+
+def run():
+    from gunicorn.app.wsgiapp import WSGIApplication
+
+    sys.argv = ["gunicorn", "--config", CONFIG_PATH, *sys.argv[1:], "app.main:app"]
+    WSGIApplication("%(prog)s [OPTIONS]").run()
+
+
+if __name__ == "__main__":
+    run()
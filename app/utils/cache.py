@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # Size bounded LRU cache whose entries each carry their own expiry time
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, expires_at: float = None):
+        # expires_at is a time.monotonic() timestamp, capped by the cache TTL
+        max_expires_at = time.monotonic() + self.ttl
+        if expires_at is None or expires_at > max_expires_at:
+            expires_at = max_expires_at
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Resolved users of authenticated requests, keyed by (email address, token)
+principal_cache = TTLCache(
+    max_size=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60")),
+)
+
+
+def invalidate_principal(email_address: str):
+    principal_cache.invalidate(lambda key: key[0] == email_address)
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.utils.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+# Buffer tree counter increments in memory instead of writing each click
+TREES_WRITE_BEHIND = os.getenv("TREES_WRITE_BEHIND", "false").lower() == "true"
+# Increments buffered for at most this long are lost if the worker crashes
+COUNTER_FLUSH_SECONDS = float(os.getenv("COUNTER_FLUSH_SECONDS", "1"))
+
+
+def _get_key(collection_name: str, document_filter: dict, upsert: bool):
+    return collection_name, tuple(sorted(document_filter.items())), upsert
+
+
+class CounterAggregator:
+    # Sums $inc deltas per document in memory and writes them with one
+    # bulk_write per collection on every flush
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending = defaultdict(lambda: defaultdict(int))
+        # Deltas taken by a flush that is still writing them
+        self._flushing = {}
+        self._lock = threading.Lock()
+        # One flush at a time, held for the whole write
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def increment(
+        self,
+        collection_name: str,
+        document_filter: dict,
+        field: str,
+        amount: int = 1,
+        upsert: bool = False,
+    ):
+        key = _get_key(collection_name, document_filter, upsert)
+        with self._lock:
+            self._pending[key][field] += amount
+
+    def pending(
+        self, collection_name: str, document_filter: dict, field: str, upsert=False
+    ):
+        # Delta not yet written, for read-your-writes on top of the database
+        key = _get_key(collection_name, document_filter, upsert)
+        with self._lock:
+            return sum(
+                fields[key].get(field, 0)
+                for fields in (self._pending, self._flushing)
+                if key in fields
+            )
+
+    def get_pending(self, collection_name: str):
+        # (filter, deltas) of every document of the collection with deltas
+        # not yet taken by a flush
+        with self._lock:
+            return [
+                (dict(document_filter), dict(fields))
+                for (name, document_filter, upsert), fields in self._pending.items()
+                if name == collection_name
+            ]
+
+    @contextmanager
+    def paused(self):
+        # No flush runs while the block runs, so reading the database and then
+        # get_pending sees every increment exactly once
+        with self._flush_lock:
+            yield
+
+    def _restore(self, pending: dict):
+        with self._lock:
+            for key, fields in pending.items():
+                self._flushing.pop(key, None)
+                for field, amount in fields.items():
+                    self._pending[key][field] += amount
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(
+                    lambda: defaultdict(int)
+                )
+                self._flushing = pending
+            if not pending:
+                return
+            try:
+                self._write(pending)
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _write(self, pending: dict):
+        keys = defaultdict(list)
+        operations = defaultdict(list)
+        for key, fields in pending.items():
+            collection_name, document_filter, upsert = key
+            keys[collection_name].append(key)
+            operations[collection_name].append(
+                UpdateOne(dict(document_filter), {"$inc": dict(fields)}, upsert=upsert)
+            )
+        db = get_db()
+        for collection_name, collection_operations in operations.items():
+            failed_keys = []
+            try:
+                db[collection_name].bulk_write(collection_operations, ordered=False)
+            except BulkWriteError as e:
+                failed_keys = [
+                    keys[collection_name][error["index"]]
+                    for error in e.details["writeErrors"]
+                ]
+            except PyMongoError:
+                # The outcome is unknown, so the deltas are retried and may
+                # end up applied twice
+                failed_keys = keys[collection_name]
+            if failed_keys:
+                logger.error(
+                    "Could not flush %s counters of %s, retrying on next flush",
+                    len(failed_keys),
+                    collection_name,
+                )
+                self._restore({key: pending[key] for key in failed_keys})
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="counter-flush", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        # Flushes whatever is still buffered
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+counters = CounterAggregator(COUNTER_FLUSH_SECONDS)
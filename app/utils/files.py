@@ -0,0 +1,124 @@
+import mimetypes
+import os
+import re
+import shutil
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request, Response, status
+from fastapi.responses import StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+# Uploaded files are never modified in place, so clients may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_range_pattern = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def save_upload(source, file_path: str):
+    # Copies an uploaded file to disk without holding it in memory
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(source, f, CHUNK_SIZE)
+
+
+def _iter_file(file_path: str, start: int, length: int):
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def etag_matches(if_none_match: str, etag: str):
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+def _not_modified_since(if_modified_since: str, mtime: float):
+    try:
+        return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _parse_range(range_header: str, size: int):
+    # Only single byte ranges are supported, anything else is ignored and the
+    # full file is sent
+    match = _range_pattern.match(range_header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        length = min(int(end), size)
+        return size - length, size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    end = int(end) if end else size - 1
+    return start, min(end, size - 1)
+
+
+def file_response(
+    request: Request,
+    file_path: str,
+    media_type: str = None,
+    headers: dict = None,
+    cache_control: str = IMMUTABLE_CACHE_CONTROL,
+):
+    stat_result = os.stat(file_path)
+    size = stat_result.st_size
+    etag = f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        **(headers or {}),
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    # If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match and etag_matches(if_none_match, etag)) or (
+        not if_none_match
+        and if_modified_since
+        and _not_modified_since(if_modified_since, stat_result.st_mtime)
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if media_type is None:
+        media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+
+    start, end = 0, size - 1
+    status_code = status.HTTP_200_OK
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if range_header and (not if_range or if_range == etag):
+        byte_range = _parse_range(range_header, size)
+    if byte_range is not None:
+        if byte_range[0] >= size:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers=headers,
+            )
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(
+        _iter_file(file_path, start, length),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,168 @@
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indexes backing the queries issued by the service modules, per collection
+INDEXES = {
+    "users": [
+        IndexModel(
+            [("emailAddress", ASCENDING)], name="emailAddress_unique", unique=True
+        ),
+    ],
+    "coupons": [
+        # Coupons written before refills used the `code` field are left out
+        IndexModel(
+            [("advertisement_id", ASCENDING), ("code", ASCENDING)],
+            name="advertisement_id_code_unique",
+            unique=True,
+            partialFilterExpression={"code": {"$exists": True}},
+        ),
+        # Random coupon claim and the already-has-coupon check
+        IndexModel(
+            [
+                ("advertisement_id", ASCENDING),
+                ("user_email", ASCENDING),
+                ("random", ASCENDING),
+            ],
+            name="advertisement_id_user_email_random",
+        ),
+        # A user holds at most one coupon per advertisement
+        IndexModel(
+            [("user_email", ASCENDING), ("advertisement_id", ASCENDING)],
+            name="user_email_advertisement_id_unique",
+            unique=True,
+            partialFilterExpression={"user_email": {"$type": "string"}},
+        ),
+        # Latest claims of a user for the profile
+        IndexModel(
+            [("user_email", ASCENDING), ("claimed_at", DESCENDING)],
+            name="user_email_claimed_at",
+        ),
+    ],
+    "advertisements": [
+        IndexModel(
+            [("approved", ASCENDING), ("closed", ASCENDING)], name="approved_closed"
+        ),
+    ],
+    "advertisement_stats": [
+        # Upserts of buffered event counts and the rollup queries
+        IndexModel(
+            [
+                ("advertisement_id", ASCENDING),
+                ("granularity", ASCENDING),
+                ("bucket", ASCENDING),
+            ],
+            name="advertisement_id_granularity_bucket_unique",
+            unique=True,
+        ),
+        # Hourly buckets are kept for 90 days, daily ones forever
+        IndexModel(
+            [("bucket", ASCENDING)],
+            name="hourly_bucket_ttl",
+            expireAfterSeconds=90 * 24 * 60 * 60,
+            partialFilterExpression={"granularity": "hour"},
+        ),
+    ],
+    "leaderboard_scores": [
+        # Upserts of buffered score increments and the reload of each board
+        IndexModel(
+            [("board", ASCENDING), ("member", ASCENDING)],
+            name="board_member_unique",
+            unique=True,
+        ),
+    ],
+}
+
+# Indexes the service relies on for correctness, not only for speed. The app
+# refuses to start without them: one coupon per user and advertisement, and
+# the duplicate code detection of coupon ingestion.
+REQUIRED_INDEXES = [
+    ("coupons", "user_email_advertisement_id_unique"),
+    ("coupons", "advertisement_id_code_unique"),
+]
+
+# Hot queries that must be answered from an index
+HOT_QUERIES = [
+    ("users", {"emailAddress": "user@example.com"}),
+    ("coupons", {"advertisement_id": "0" * 24, "user_email": {"$exists": False}}),
+    ("coupons", {"advertisement_id": "0" * 24, "user_email": "user@example.com"}),
+    ("coupons", {"user_email": "user@example.com"}),
+    ("advertisements", {"approved": True, "closed": False}),
+]
+
+
+def ensure_indexes(db):
+    # create_indexes is a no-op for indexes that already exist with the same spec
+    failed = []
+    for collection_name, index_models in INDEXES.items():
+        for index_model in index_models:
+            try:
+                db[collection_name].create_indexes([index_model])
+            except OperationFailure as e:
+                name = index_model.document["name"]
+                logger.error(
+                    "Could not create index %s.%s: %s", collection_name, name, e
+                )
+                failed.append((collection_name, name))
+    return failed
+
+
+def get_missing_indexes(db):
+    missing = []
+    for collection_name, index_models in INDEXES.items():
+        existing = db[collection_name].index_information()
+        for index_model in index_models:
+            name = index_model.document["name"]
+            if name not in existing:
+                missing.append((collection_name, name))
+    return missing
+
+
+def check_required_indexes(db):
+    missing = [index for index in get_missing_indexes(db) if index in REQUIRED_INDEXES]
+    if missing:
+        raise RuntimeError(
+            "Required indexes are missing, run `python -m app.cli dedupe-coupons` "
+            "and `python -m app.cli indexes`: "
+            + ", ".join(f"{collection}.{name}" for collection, name in missing)
+        )
+
+
+def get_unused_indexes(db):
+    # Access counters are reset when mongod restarts, so this is only
+    # meaningful on a server that has been serving traffic for a while
+    unused = []
+    for collection_name in INDEXES:
+        for stats in db[collection_name].aggregate([{"$indexStats": {}}]):
+            if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                unused.append((collection_name, stats["name"]))
+    return unused
+
+
+def _get_plan_stages(plan):
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages += _get_plan_stages(plan["inputStage"])
+    for input_stage in plan.get("inputStages", []):
+        stages += _get_plan_stages(input_stage)
+    return stages
+
+
+def is_index_backed(db, collection_name: str, query: dict):
+    explanation = db[collection_name].find(query).explain()
+    winning_plan = explanation["queryPlanner"]["winningPlan"]
+    # Slot based engine explain output nests the classic plan
+    winning_plan = winning_plan.get("queryPlan", winning_plan)
+    stages = _get_plan_stages(winning_plan)
+    return "COLLSCAN" not in stages and ("IXSCAN" in stages or "IDHACK" in stages)
+
+
+def get_unindexed_hot_queries(db):
+    return [
+        (collection_name, query)
+        for collection_name, query in HOT_QUERIES
+        if not is_index_backed(db, collection_name, query)
+    ]
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from email.message import EmailMessage
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+MAIL_USERNAME = os.getenv("EMAIL_ADDRESS")
+MAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+MAIL_FROM = os.getenv("MAIL_FROM", "treetap.yyy@gmail.com")
+MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = int(os.getenv("MAIL_PORT", "465"))
+MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "true").lower() == "true"
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "false").lower() == "true"
+
+# The queue lives in a local SQLite file shared by every worker on the host
+MAIL_QUEUE_PATH = os.getenv("MAIL_QUEUE_PATH", "mail_queue.sqlite3")
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "8"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "5"))
+MAIL_RETRY_MAX_SECONDS = float(os.getenv("MAIL_RETRY_MAX_SECONDS", "3600"))
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "5"))
+# A claimed message that is neither sent nor rescheduled within the lease,
+# for instance because its worker died, becomes due again
+MAIL_LEASE_SECONDS = 300
+# Idle SMTP connections are closed after this long without anything to send
+MAIL_IDLE_SECONDS = 30
+
+_worker = None
+_worker_task = None
+_wake_up = None
+
+
+def _connect():
+    # Autocommit mode, transactions are opened explicitly where needed
+    return closing(sqlite3.connect(MAIL_QUEUE_PATH, timeout=30, isolation_level=None))
+
+
+def _create_queue():
+    with _connect() as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbound_mail (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                body TEXT NOT NULL,
+                subtype TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                failed INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS outbound_mail_due "
+            "ON outbound_mail (failed, next_attempt_at)"
+        )
+
+
+def _insert_message(subject, recipients, body, subtype):
+    with _connect() as connection:
+        connection.execute(
+            "INSERT INTO outbound_mail (subject, recipients, body, subtype, "
+            "next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+            (subject, json.dumps(recipients), body, subtype, time.time()),
+        )
+
+
+def _claim_due_messages(limit: int):
+    # Claiming pushes next_attempt_at out by the lease so that workers in
+    # other processes skip these messages while they are being sent
+    now = time.time()
+    with _connect() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        rows = connection.execute(
+            "SELECT id, subject, recipients, body, subtype, attempts "
+            "FROM outbound_mail WHERE failed = 0 AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT ?",
+            (now, limit),
+        ).fetchall()
+        connection.executemany(
+            "UPDATE outbound_mail SET next_attempt_at = ?, attempts = attempts + 1 "
+            "WHERE id = ?",
+            [(now + MAIL_LEASE_SECONDS, row[0]) for row in rows],
+        )
+        connection.execute("COMMIT")
+    return [
+        {
+            "id": row[0],
+            "subject": row[1],
+            "recipients": json.loads(row[2]),
+            "body": row[3],
+            "subtype": row[4],
+            "attempts": row[5] + 1,
+        }
+        for row in rows
+    ]
+
+
+def _delete_message(message_id: int):
+    with _connect() as connection:
+        connection.execute("DELETE FROM outbound_mail WHERE id = ?", (message_id,))
+
+
+def _reschedule_message(message_id: int, attempts: int, error: str):
+    failed = attempts >= MAIL_MAX_ATTEMPTS
+    delay = min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), MAIL_RETRY_MAX_SECONDS)
+    with _connect() as connection:
+        connection.execute(
+            "UPDATE outbound_mail SET next_attempt_at = ?, failed = ?, "
+            "last_error = ? WHERE id = ?",
+            (time.time() + delay, int(failed), error, message_id),
+        )
+    if failed:
+        logger.error("Giving up on mail %s after %s attempts", message_id, attempts)
+
+
+def _build_email(message: dict):
+    email = EmailMessage()
+    email["From"] = MAIL_FROM
+    email["To"] = ", ".join(message["recipients"])
+    email["Subject"] = message["subject"]
+    email.set_content(message["body"], subtype=message["subtype"])
+    return email
+
+
+async def enqueue_message(subject: str, recipients: list, body: str, subtype="plain"):
+    await asyncio.to_thread(_insert_message, subject, recipients, body, subtype)
+    if _wake_up is not None:
+        _wake_up.set()
+
+
+class MailWorker:
+    # Sends queued mail in batches over a single reused SMTP connection
+
+    def __init__(self):
+        self._smtp = None
+        self._last_sent_at = 0.0
+
+    async def _get_smtp(self):
+        if self._smtp is None or not self._smtp.is_connected:
+            self._smtp = aiosmtplib.SMTP(
+                hostname=MAIL_SERVER,
+                port=MAIL_PORT,
+                use_tls=MAIL_SSL_TLS,
+                start_tls=MAIL_STARTTLS,
+            )
+            await self._smtp.connect()
+            if MAIL_USERNAME and MAIL_PASSWORD:
+                await self._smtp.login(MAIL_USERNAME, MAIL_PASSWORD)
+        return self._smtp
+
+    async def close(self):
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                await self._smtp.quit()
+            except aiosmtplib.SMTPException:
+                self._smtp.close()
+        self._smtp = None
+
+    async def send_batch(self):
+        messages = await asyncio.to_thread(_claim_due_messages, MAIL_BATCH_SIZE)
+        for message in messages:
+            try:
+                email = _build_email(message)
+                smtp = await self._get_smtp()
+                await smtp.send_message(email)
+            except Exception as e:
+                # A message that cannot be built, for instance because of a
+                # missing or malformed recipient, is retried and eventually
+                # failed like any other, the connection is only dropped when
+                # it is the problem
+                logger.warning("Could not send mail %s: %s", message["id"], e)
+                if isinstance(e, (aiosmtplib.SMTPException, OSError)):
+                    await self.close()
+                await asyncio.to_thread(
+                    _reschedule_message, message["id"], message["attempts"], str(e)
+                )
+            else:
+                self._last_sent_at = time.monotonic()
+                await asyncio.to_thread(_delete_message, message["id"])
+        return len(messages)
+
+    async def run(self):
+        while True:
+            try:
+                sent = await self.send_batch()
+            except Exception:
+                logger.exception("Mail worker failed to process the queue")
+                sent = 0
+            if sent:
+                continue
+            if time.monotonic() - self._last_sent_at > MAIL_IDLE_SECONDS:
+                await self.close()
+            try:
+                await asyncio.wait_for(_wake_up.wait(), MAIL_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _wake_up.clear()
+
+
+def start_worker():
+    global _worker, _worker_task, _wake_up
+    _create_queue()
+    _wake_up = asyncio.Event()
+    _worker = MailWorker()
+    _worker_task = asyncio.create_task(_worker.run())
+
+
+async def stop_worker():
+    global _worker, _worker_task
+    if _worker is None:
+        return
+    _worker_task.cancel()
+    try:
+        await _worker_task
+    except asyncio.CancelledError:
+        pass
+    await _worker.close()
+    _worker = None
+    _worker_task = None
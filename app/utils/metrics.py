@@ -0,0 +1,89 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# With PROMETHEUS_MULTIPROC_DIR set, every gunicorn worker writes its samples
+# to files in that directory and /metrics aggregates them, so any worker can
+# answer the scrape
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Requests that did not match any route share one label value to keep the
+# number of series bounded
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being handled",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+# Labelled metrics only create their samples when first used, so importing
+# this module in the gunicorn master before the fork writes nothing
+COLD_START = Gauge(
+    "app_cold_start_seconds",
+    "Time from forking or starting the worker until it was ready to serve",
+    ["preloaded"],
+    multiprocess_mode="liveall",
+)
+REJECTED_REQUESTS = Counter(
+    "http_requests_rejected_total",
+    "HTTP requests rejected by rate limiting or load shedding",
+    ["route", "reason"],
+)
+
+
+def generate_metrics():
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            in_progress.dec()
+            # The router stores the matched route in the scope, its path
+            # template is used instead of the raw path
+            route = scope.get("route")
+            route = getattr(route, "path_format", None) or UNMATCHED_ROUTE
+            REQUEST_LATENCY.labels(method, route, str(status_code)).observe(duration)
@@ -0,0 +1,202 @@
+import os
+import threading
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, monitoring
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+
+from app.utils.query_trace import command_tracer
+
+DATABASE_NAME = os.getenv("MONGO_DB_NAME", "dev")
+
+_client = None
+_db = None
+_client_lock = threading.Lock()
+
+_async_client = None
+_async_db = None
+
+
+def _get_int_env(name: str, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _get_write_concern():
+    w = os.getenv("MONGO_WRITE_CONCERN")
+    if w is None:
+        return WriteConcern()
+    w = int(w) if w.isdigit() else w
+    return WriteConcern(w=w, wtimeout=_get_int_env("MONGO_WRITE_TIMEOUT_MS", None))
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    # Tracks connection pool usage across all servers the client talks to
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "waiting": self.waiting,
+                "checkout_failures": self.checkout_failures,
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+
+# One per client, the sync and the Motor client each have their own pools
+pool_stats_listener = PoolStatsListener()
+async_pool_stats_listener = PoolStatsListener()
+
+
+def get_client_options():
+    return {
+        "maxPoolSize": _get_int_env("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _get_int_env("MONGO_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": _get_int_env("MONGO_MAX_IDLE_TIME_MS", None),
+        "waitQueueTimeoutMS": _get_int_env("MONGO_WAIT_QUEUE_TIMEOUT_MS", None),
+        "connectTimeoutMS": _get_int_env("MONGO_CONNECT_TIMEOUT_MS", 20000),
+        "socketTimeoutMS": _get_int_env("MONGO_SOCKET_TIMEOUT_MS", None),
+        "serverSelectionTimeoutMS": _get_int_env(
+            "MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000
+        ),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+    }
+
+
+def get_async_client_options():
+    # Every worker has both clients, so it can open up to the sum of both
+    # pool sizes. The Motor pool can be capped on its own to keep that sum
+    # within the server's connection budget.
+    options = get_client_options()
+    options["maxPoolSize"] = _get_int_env(
+        "MONGO_ASYNC_MAX_POOL_SIZE", options["maxPoolSize"]
+    )
+    return options
+
+
+def get_client():
+    # The client is created on first use so importing the service modules
+    # does not open any connections
+    global _client, _db
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = MongoClient(
+                    os.getenv("MONGO_URI"),
+                    event_listeners=[pool_stats_listener, command_tracer],
+                    **get_client_options(),
+                )
+                _db = client.get_database(
+                    DATABASE_NAME,
+                    read_concern=ReadConcern(os.getenv("MONGO_READ_CONCERN")),
+                    write_concern=_get_write_concern(),
+                )
+                _client = client
+    return _client
+
+
+def get_db():
+    if _db is None:
+        get_client()
+    return _db
+
+
+def close_client():
+    global _client, _db
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            _db = None
+
+
+def get_async_client():
+    # Motor binds to the running event loop, so the async client is only
+    # created from within it and never needs a lock
+    global _async_client, _async_db
+    if _async_client is None:
+        _async_client = AsyncIOMotorClient(
+            os.getenv("MONGO_URI"),
+            event_listeners=[async_pool_stats_listener, command_tracer],
+            **get_async_client_options(),
+        )
+        _async_db = _async_client.get_database(
+            DATABASE_NAME,
+            read_concern=ReadConcern(os.getenv("MONGO_READ_CONCERN")),
+            write_concern=_get_write_concern(),
+        )
+    return _async_client
+
+
+def get_async_db():
+    if _async_db is None:
+        get_async_client()
+    return _async_db
+
+
+def close_async_client():
+    global _async_client, _async_db
+    if _async_client is not None:
+        _async_client.close()
+        _async_client = None
+        _async_db = None
+
+
+def get_pool_stats():
+    stats = {}
+    for name, listener, options in (
+        ("sync", pool_stats_listener, get_client_options()),
+        ("async", async_pool_stats_listener, get_async_client_options()),
+    ):
+        stats[name] = listener.stats()
+        stats[name]["max_pool_size"] = options["maxPoolSize"]
+    return stats
@@ -0,0 +1,76 @@
+import re
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Query, status
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Clients get the cursor of the next page in this header, it is absent on
+# the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+_field_pattern = re.compile(r"^-?[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class PageParams:
+    # Keyset pagination over _id with an optional field projection. `fields`
+    # is a comma separated list of fields to return, or of fields to leave
+    # out when every name is prefixed with "-".
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        after: str = Query(None),
+        fields: str = Query(None),
+    ):
+        self.limit = limit
+        self.after = _parse_cursor(after)
+        self.projection = parse_fields(fields)
+
+
+def _parse_cursor(after: str):
+    if after is None:
+        return None
+    try:
+        return ObjectId(after)
+    except (InvalidId, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+def parse_fields(fields: str):
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if not all(_field_pattern.match(name) for name in names):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid fields"
+        )
+    excluded = [name.startswith("-") for name in names]
+    if any(excluded) and not all(excluded):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Fields must be either all included or all excluded",
+        )
+    if all(excluded):
+        return {name[1:]: 0 for name in names if name != "-_id"} or None
+    # _id is always returned, it is the cursor
+    return {"_id": 1, **{name: 1 for name in names}}
+
+
+def project(document: dict, projection: dict):
+    # Applies a projection from PageParams to a document already in memory
+    if projection is None:
+        return document
+    if any(projection.values()):
+        return {key: document[key] for key in projection if key in document}
+    return {key: value for key, value in document.items() if key not in projection}
+
+
+def set_next_cursor(response, page: list, limit: int):
+    # A full page may be followed by another one
+    if len(page) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(page[-1]["_id"])
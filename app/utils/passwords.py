@@ -0,0 +1,57 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a thread pool hashes on several cores at once
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hash operations allowed to wait for a worker before requests are shed
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "16"))
+
+# Pinning the minimum and maximum rounds to the configured cost makes
+# needs_update flag every hash made with a different cost factor
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+async def _run(func, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, func, *args)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password(password: str):
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    # Returns whether the password matches and, if the stored hash uses an
+    # outdated cost factor, a replacement hash to store
+    return await _run(pwd_context.verify_and_update, password, hashed_password)
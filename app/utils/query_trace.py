@@ -0,0 +1,163 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Commands slower than this are logged with the shape of their filter
+MONGO_SLOW_COMMAND_MS = float(os.getenv("MONGO_SLOW_COMMAND_MS", "100"))
+# Debug mode, adds the command count and time of each request to its response
+MONGO_QUERY_HEADERS = os.getenv("MONGO_QUERY_HEADERS", "false").lower() == "true"
+COMMANDS_HEADER = "X-Mongo-Commands"
+TIME_HEADER = "X-Mongo-Time-Ms"
+
+# Commands that only keep the connection alive or discover the servers
+_ignored_commands = {"hello", "ismaster", "isMaster", "ping", "endSessions"}
+
+# Trace of the HTTP request being handled. The threadpool and Motor copy the
+# context, so commands issued from either are attributed to the request.
+_current_trace = ContextVar("mongo_query_trace", default=None)
+# Callbacks run with the trace of every finished request
+_finished_callbacks = []
+
+
+class QueryTrace:
+    def __init__(self, path: str = None):
+        self.path = path
+        self.count = 0
+        self.duration_ms = 0.0
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def add(self, command_name: str, collection_name: str, duration_ms: float):
+        with self._lock:
+            self.count += 1
+            self.duration_ms += duration_ms
+            self.commands.append(f"{command_name} {collection_name}")
+
+
+def get_filter_shape(value):
+    # The filter with every value replaced by "?", so that slow commands of
+    # the same query can be grouped without logging user data
+    if isinstance(value, dict):
+        return {key: get_filter_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [get_filter_shape(item) for item in value]
+    return "?"
+
+
+def _get_filter(command_name: str, command):
+    # Bulk updates and deletes are represented by their first statement
+    if command_name in ("update", "delete"):
+        statements = command.get(f"{command_name}s") or [{}]
+        return statements[0].get("q")
+    if command_name == "aggregate":
+        return command.get("pipeline")
+    return command.get("filter", command.get("query"))
+
+
+class CommandTracer(monitoring.CommandListener):
+    # Attributes every command to the current request and logs slow ones
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        if event.command_name in _ignored_commands:
+            return
+        # The command document is only inspected if the command turns out
+        # to be slow
+        self._started[(event.connection_id, event.request_id)] = (
+            event.command,
+            _current_trace.get(),
+        )
+
+    def _finished(self, event):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        command, trace = started
+        collection_name = command.get(event.command_name)
+        if not isinstance(collection_name, str):
+            collection_name = ""
+        duration_ms = event.duration_micros / 1000
+        if trace is not None:
+            trace.add(event.command_name, collection_name, duration_ms)
+        if duration_ms >= MONGO_SLOW_COMMAND_MS:
+            logger.warning(
+                "Slow Mongo command %s on %s took %.1fms during %s, filter %s",
+                event.command_name,
+                collection_name,
+                duration_ms,
+                trace.path if trace is not None else "no request",
+                get_filter_shape(_get_filter(event.command_name, command)),
+            )
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+
+command_tracer = CommandTracer()
+
+
+class QueryTraceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = QueryTrace(scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and MONGO_QUERY_HEADERS:
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (COMMANDS_HEADER.lower().encode(), str(trace.count).encode()),
+                    (
+                        TIME_HEADER.lower().encode(),
+                        f"{trace.duration_ms:.3f}".encode(),
+                    ),
+                ]
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            for callback in list(_finished_callbacks):
+                callback(trace)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int):
+    # Test helper, fails if the code in the block or any request handled
+    # while it runs issues more than max_queries Mongo commands:
+    #
+    #     with assert_max_queries(3):
+    #         client.get("/apps/auth/profile", headers=headers)
+    block_trace = QueryTrace("test block")
+    traces = [block_trace]
+    token = _current_trace.set(block_trace)
+    _finished_callbacks.append(traces.append)
+    try:
+        yield traces
+    finally:
+        _finished_callbacks.remove(traces.append)
+        _current_trace.reset(token)
+    for trace in traces:
+        if trace.count > max_queries:
+            raise AssertionError(
+                f"{trace.path} issued {trace.count} Mongo commands, at most "
+                f"{max_queries} expected: {', '.join(trace.commands)}"
+            )
@@ -0,0 +1,250 @@
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import closing
+
+import jwt
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from app.utils.metrics import REJECTED_REQUESTS
+from app.utils.utils import ALGORITHM, SECRET_KEY
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# "memory" keeps one set of buckets per worker, "sqlite" shares them between
+# the workers on a host through a local file
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_PATH = os.getenv("RATE_LIMIT_PATH", "rate_limit.sqlite3")
+# Only trust X-Forwarded-For behind a proxy that sets it
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Requests being handled and requests turned away by this worker, per path
+in_flight_requests = defaultdict(int)
+rejected_requests = defaultdict(lambda: {"rate_limited": 0, "shed": 0})
+
+
+class RateLimit:
+    # Token bucket refilled with `requests` tokens every `seconds`, holding
+    # at most `burst` tokens. Requests beyond max_in_flight concurrent ones
+    # in this worker are shed before they reach the bucket. Buckets are per
+    # authenticated user when by_user is set, per client address otherwise.
+
+    def __init__(
+        self, requests: int, seconds: float, burst=None, max_in_flight=0, by_user=False
+    ):
+        self.rate = requests / seconds
+        self.burst = burst or requests
+        self.max_in_flight = max_in_flight
+        self.by_user = by_user
+
+
+def _get_rate_limit(name: str, default: str, max_in_flight: str, by_user=False):
+    # Budgets are configured as "<requests>/<seconds>", e.g. "30/60"
+    requests, seconds = os.getenv(f"RATE_LIMIT_{name}", default).split("/")
+    return RateLimit(
+        int(requests),
+        float(seconds),
+        max_in_flight=int(os.getenv(f"RATE_LIMIT_{name}_MAX_IN_FLIGHT", max_in_flight)),
+        by_user=by_user,
+    )
+
+
+# Budgets per (method, path). /plant is keyed by the authenticated user,
+# /login and /signup by the client address whatever token is sent, since
+# accounts are free and a bucket per account would not slow down guessing.
+ROUTE_LIMITS = {
+    ("POST", "/apps/auth/plant"): _get_rate_limit("PLANT", "30/60", "64", True),
+    ("POST", "/apps/auth/login"): _get_rate_limit("LOGIN", "10/60", "0"),
+    ("POST", "/apps/auth/signup"): _get_rate_limit("SIGNUP", "5/60", "0"),
+}
+
+
+def _take_token(tokens: float, updated_at: float, limit: RateLimit, now: float):
+    # Returns the tokens left and how long to wait if the bucket was empty
+    tokens = min(limit.burst, tokens + (now - updated_at) * limit.rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / limit.rate
+
+
+class MemoryStore:
+    # Buckets of this worker, the least recently used are dropped first
+    blocking = False
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit: RateLimit):
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (limit.burst, now))
+            tokens, retry_after = _take_token(tokens, updated_at, limit, now)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SQLiteStore:
+    # Buckets shared by every worker on the host, like the mail queue
+    blocking = True
+
+    # Rows of buckets that have been full for this long are deleted every
+    # prune_every takes
+    prune_every = 1000
+    max_age = 3600
+
+    def __init__(self, path: str):
+        self.path = path
+        self._created = False
+        self._takes = 0
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        if not self._created:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._created = True
+        return closing(connection)
+
+    def take(self, key, limit: RateLimit):
+        key = "|".join(key)
+        now = time.time()
+        with self._connect() as connection:
+            # IMMEDIATE takes the write lock up front so that concurrent
+            # workers cannot both spend the last token
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                tokens, updated_at = row or (limit.burst, now)
+                tokens, retry_after = _take_token(tokens, updated_at, limit, now)
+                connection.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            self._takes += 1
+            if self._takes % self.prune_every == 0:
+                connection.execute(
+                    "DELETE FROM rate_limit_buckets WHERE updated_at < ?",
+                    (now - self.max_age,),
+                )
+        return retry_after
+
+
+def create_store():
+    if RATE_LIMIT_STORE == "sqlite":
+        return SQLiteStore(RATE_LIMIT_PATH)
+    return MemoryStore(RATE_LIMIT_MAX_KEYS)
+
+
+def _get_header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def get_client_address(scope):
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded_for = _get_header(scope, b"x-forwarded-for")
+        if forwarded_for:
+            return forwarded_for.split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def get_client_key(scope):
+    # The email of a valid bearer token, the client address otherwise. The
+    # token is only decoded here, the endpoint still authenticates the user.
+    authorization = _get_header(scope, b"authorization")
+    if authorization and authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            payload = {}
+        if payload.get("sub"):
+            return "user:" + payload["sub"]
+    return "ip:" + get_client_address(scope)
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, store=None, route_limits=None):
+        self.app = app
+        self.store = store or create_store()
+        self.route_limits = ROUTE_LIMITS if route_limits is None else route_limits
+
+    async def _reject(self, scope, receive, send, reason, detail, retry_after):
+        rejected_requests[scope["path"]][reason] += 1
+        REJECTED_REQUESTS.labels(scope["path"], reason).inc()
+        status_code = (
+            status.HTTP_429_TOO_MANY_REQUESTS
+            if reason == "rate_limited"
+            else status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response = JSONResponse(
+            {"detail": detail},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http" and RATE_LIMIT_ENABLED:
+            limit = self.route_limits.get((scope["method"], scope["path"]))
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"]
+        if limit.max_in_flight and in_flight_requests[route] >= limit.max_in_flight:
+            await self._reject(
+                scope, receive, send, "shed", "Server is busy, please try again", 1
+            )
+            return
+
+        if limit.by_user:
+            key = (route, get_client_key(scope))
+        else:
+            key = (route, "ip:" + get_client_address(scope))
+        if self.store.blocking:
+            retry_after = await asyncio.to_thread(self.store.take, key, limit)
+        else:
+            retry_after = self.store.take(key, limit)
+        if retry_after:
+            await self._reject(
+                scope, receive, send, "rate_limited", "Too many requests", retry_after
+            )
+            return
+
+        in_flight_requests[route] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            in_flight_requests[route] -= 1
+
+
+def get_stats():
+    return {
+        "in_flight": dict(in_flight_requests),
+        "rejected": {
+            route: dict(counts) for route, counts in rejected_requests.items()
+        },
+    }
@@ -1,15 +1,21 @@
 import jwt
 import datetime
 import os
-from fastapi import Depends, HTTPException
+import time
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
-from app.auth.service import database
+from app.auth.service import async_database
+from app.utils.cache import principal_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 # Secret key for JWT token
 SECRET_KEY = os.getenv("SECRET_KEY")
 # Algorithm used for JWT token encoding
 ALGORITHM = "HS256"
+# Operational endpoints are only answered on the port of this address, which
+# the server binds on a private interface next to the public one
+INTERNAL_BIND = os.getenv("INTERNAL_BIND", "127.0.0.1:9100")
+INTERNAL_PORT = int(INTERNAL_BIND.rpartition(":")[2])
 
 
 def create_access_token(data: dict, expires_delta: datetime.timedelta):
@@ -20,6 +26,13 @@ def create_access_token(data: dict, expires_delta: datetime.timedelta):
     return encoded_jwt
 
 
+def require_internal(request: Request):
+    # The port the connection was accepted on, whatever the client claims
+    server = request.scope.get("server")
+    if not server or server[1] != INTERNAL_PORT:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -32,7 +45,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = database.get_user(emailAddress)
+    user = principal_cache.get((emailAddress, token))
+    if user is not None:
+        return user
+    user = await async_database.get_user(emailAddress)
     if user is None:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    # Never keep the user around for longer than the token is valid
+    expires_at = None
+    if "exp" in payload:
+        expires_at = time.monotonic() + (payload["exp"] - time.time())
+    principal_cache.set((emailAddress, token), user, expires_at)
     return user
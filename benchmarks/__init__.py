@@ -0,0 +1,11 @@
+def get_benchmark_db():
+    # Benchmarks write to the database and may reset it, so they only run
+    # against one whose name marks it as a benchmark database
+    from app.utils import mongo
+
+    db = mongo.get_db()
+    if "bench" not in db.name:
+        raise SystemExit(
+            f"Refusing to use {db.name}, set MONGO_DB_NAME to a benchmark database"
+        )
+    return db
@@ -0,0 +1,113 @@
+"""
+Advertisement analytics benchmark, run with `python -m benchmarks.analytics_events`
+
+Records impressions and clicks at a fixed rate for a while, flushing the
+counter aggregator like its background thread would, and reports the rate
+achieved, the cost of recording an event and of each flush, and how many
+documents were written compared to one write per event. Point
+MONGO_URI/MONGO_DB_NAME at a benchmark database, MONGO_DB_NAME must contain
+"bench". The benchmark removes the buckets it created.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# Settings read when the app is imported
+os.environ.setdefault("MONGO_DB_NAME", "treetap_benchmark")
+
+from bson import ObjectId  # noqa: E402
+
+from app.advertisement.service import analytics  # noqa: E402
+from app.utils import indexes  # noqa: E402
+from app.utils.counters import counters  # noqa: E402
+from app.utils.mongo import get_db  # noqa: E402
+from benchmarks import get_benchmark_db  # noqa: E402
+
+# Impressions are recorded a feed page at a time
+PAGE_SIZE = 10
+
+
+def _percentile(sorted_values: list, percentile: float):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percentile))
+    return sorted_values[index]
+
+
+def run(rate: int, seconds: float, advertisements: int, click_ratio: float):
+    advertisement_ids = [str(ObjectId()) for _ in range(advertisements)]
+    random.seed(0)
+    events = 0
+    record_time = 0.0
+    flush_times = []
+    start = time.perf_counter()
+    next_flush = start + counters.flush_interval
+    while True:
+        now = time.perf_counter()
+        if now - start >= seconds:
+            break
+        # Catch up to the events due by now, then wait for the next tick
+        due = int((now - start) * rate) - events
+        while due > 0:
+            record_start = time.perf_counter()
+            if random.random() < click_ratio:
+                analytics.record_click(random.choice(advertisement_ids), 1)
+                recorded = 1
+            else:
+                page = random.sample(advertisement_ids, min(PAGE_SIZE, due))
+                analytics.record_impressions(page)
+                recorded = len(page)
+            record_time += time.perf_counter() - record_start
+            events += recorded
+            due -= recorded
+        if now >= next_flush:
+            flush_start = time.perf_counter()
+            counters.flush()
+            flush_times.append(time.perf_counter() - flush_start)
+            next_flush += counters.flush_interval
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    flush_start = time.perf_counter()
+    counters.flush()
+    flush_times.append(time.perf_counter() - flush_start)
+
+    collection = get_db().advertisement_stats
+    documents = collection.count_documents(
+        {"advertisement_id": {"$in": advertisement_ids}}
+    )
+    collection.delete_many({"advertisement_id": {"$in": advertisement_ids}})
+    flush_times.sort()
+    return {
+        "target_rate": rate,
+        "achieved_rate": round(events / elapsed),
+        "events": events,
+        "record_us_per_event": round(record_time / events * 1e6, 2),
+        "flushes": len(flush_times),
+        "flush_p50_ms": round(_percentile(flush_times, 0.5) * 1000, 2),
+        "flush_max_ms": round(flush_times[-1] * 1000, 2),
+        "documents": documents,
+        # Every event updates one bucket per granularity without buffering
+        "unbuffered_writes": events * len(analytics.GRANULARITIES),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.analytics_events")
+    parser.add_argument("--rate", type=int, default=10000, help="Events per second")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--advertisements", type=int, default=200)
+    parser.add_argument("--click-ratio", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    indexes.ensure_indexes(get_benchmark_db())
+    result = run(args.rate, args.seconds, args.advertisements, args.click_ratio)
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Coupon ingestion benchmark, run with `python -m benchmarks.coupon_ingest`
+
+Point MONGO_URI/MONGO_DB_NAME at a benchmark database, MONGO_DB_NAME must
+contain "bench". The benchmark creates and removes its own advertisements
+and coupons.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Settings read when the app is imported
+os.environ.setdefault("MONGO_DB_NAME", "treetap_benchmark")
+
+from bson import ObjectId  # noqa: E402
+
+from app.auth.service import coupon_ingest  # noqa: E402
+from app.utils import indexes  # noqa: E402
+from benchmarks import get_benchmark_db  # noqa: E402
+
+
+def _write_codes(size: int):
+    fd, file_path = tempfile.mkstemp(prefix="coupons-", suffix=".csv")
+    with os.fdopen(fd, "w") as f:
+        f.write("code\n")
+        for i in range(size):
+            f.write(f"BENCH-{i:09d}\n")
+    return file_path
+
+
+def _ingest(advertisement_id: str, file_path: str, batch_size: int):
+    start = time.perf_counter()
+    with open(file_path, "rb") as f:
+        result = coupon_ingest.ingest_coupon_codes(
+            advertisement_id,
+            coupon_ingest.read_coupon_codes(f),
+            batch_size=batch_size,
+        )
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    result["codes_per_second"] = round(
+        (result["accepted"] + result["duplicates"]) / result["seconds"]
+    )
+    return result
+
+
+def run(db, size: int, batch_size: int):
+    advertisement_id = str(
+        db.advertisements.insert_one(
+            {"company_name": "benchmark", "approved": True, "closed": False}
+        ).inserted_id
+    )
+    file_path = _write_codes(size)
+    try:
+        # The second pass measures the all-duplicates path of a re-upload
+        return {
+            "size": size,
+            "batch_size": batch_size,
+            "fresh": _ingest(advertisement_id, file_path, batch_size),
+            "duplicate": _ingest(advertisement_id, file_path, batch_size),
+        }
+    finally:
+        os.remove(file_path)
+        db.coupons.delete_many({"advertisement_id": advertisement_id})
+        db.advertisements.delete_one({"_id": ObjectId(advertisement_id)})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.coupon_ingest")
+    parser.add_argument(
+        "--sizes",
+        default="10000,100000,1000000",
+        help="Comma separated numbers of codes to ingest",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=coupon_ingest.COUPON_INSERT_BATCH_SIZE
+    )
+    args = parser.parse_args(argv)
+
+    db = get_benchmark_db()
+    # Duplicates are only detected with the unique index in place
+    indexes.ensure_indexes(db)
+    for size in args.sizes.split(","):
+        print(json.dumps(run(db, int(size), args.batch_size)), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Advertisement image bytes, run with `python -m benchmarks.image_renditions`
+
+Writes the renditions of an image (a generated 2400x1600 photo-like JPEG by
+default, or --image) into a temporary directory and reports the bytes of
+the upload and of every rendition, the time taken to generate them, and
+the image bytes of one feed page when it loads the original versus the
+feed rendition.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageFilter
+
+from app.advertisement.service import images
+
+
+def _write_photo(path: str, width: int, height: int):
+    # Smoothed noise plus a gradient compresses about like a photo, unlike a
+    # flat color
+    noise = Image.effect_noise((width // 8, height // 8), 48).convert("RGB")
+    noise = noise.resize((width, height), Image.BICUBIC)
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    photo = Image.blend(noise, gradient, 0.5).filter(ImageFilter.GaussianBlur(2))
+    photo.save(path, "JPEG", quality=90)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.image_renditions")
+    parser.add_argument("--image", help="Defaults to a generated 2400x1600 JPEG")
+    parser.add_argument("--page-size", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix="renditions-")
+    try:
+        upload_path = os.path.join(directory, "upload.jpg")
+        if args.image:
+            shutil.copyfile(args.image, upload_path)
+        else:
+            _write_photo(upload_path, 2400, 1600)
+
+        start = time.perf_counter()
+        stripped_path, renditions = images.write_renditions(upload_path)
+        elapsed = time.perf_counter() - start
+
+        upload_bytes = os.path.getsize(upload_path)
+        result = {
+            "upload_bytes": upload_bytes,
+            "original_bytes": os.path.getsize(stripped_path),
+            "renditions_bytes": {
+                f"{size}.{extension}": os.path.getsize(path)
+                for size, paths in renditions.items()
+                for extension, path in paths.items()
+            },
+            "generate_ms": round(elapsed * 1000, 1),
+        }
+        # Every advertisement of the page loads its image once
+        result["feed_page_bytes"] = {
+            "original": upload_bytes * args.page_size,
+            **{
+                extension: os.path.getsize(path) * args.page_size
+                for extension, path in renditions["feed"].items()
+            },
+        }
+    finally:
+        shutil.rmtree(directory)
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
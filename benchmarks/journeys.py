@@ -0,0 +1,315 @@
+"""
+Load test of the core user journeys, run with `python -m benchmarks.journeys`
+
+Seeds a scratch database with users, approved advertisements and coupons,
+then drives signup, login, the feed, /filter, /plant and /profile at the
+given concurrency and reports throughput and latency percentiles per route.
+By default the app from app/main.py is called in process through its ASGI
+interface; --url targets a running server instead, e.g. gunicorn, which
+must use the same MONGO_URI and MONGO_DB_NAME.
+
+--login-storm N also runs --storm-routes again while N clients log in
+without pause, to measure how bcrypt-heavy logins slow down unrelated
+routes; those results are reported as e.g. "feed+login_storm".
+
+Transactions need a replica set, run with MONGO_TRANSACTIONS=false against a
+standalone mongod. Results are written as JSON and can be compared with an
+earlier run with --compare.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+# Settings read when the app is imported
+os.environ.setdefault("MONGO_DB_NAME", "treetap_benchmark")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx  # noqa: E402
+
+from app.auth.service import coupon_ingest  # noqa: E402
+from app.utils import indexes, mongo  # noqa: E402
+from app.utils.passwords import pwd_context  # noqa: E402
+from app.utils.utils import create_access_token  # noqa: E402
+from benchmarks import get_benchmark_db  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+PASSWORD = "benchmark-password"
+ROUTES = ("signup", "login", "feed", "filter", "plant", "profile")
+
+
+def seed(users: int, advertisements: int, coupons: int):
+    db = get_benchmark_db()
+    mongo.get_client().drop_database(db.name)
+    indexes.ensure_indexes(db)
+
+    # Every seeded user shares one hash, hashing each would dominate seeding
+    hashed_password = pwd_context.hash(PASSWORD)
+    emails = [f"user{i}@benchmark.treetap.net" for i in range(users)]
+    db.users.insert_many(
+        [
+            {"emailAddress": email, "hashed_password": hashed_password}
+            for email in emails
+        ]
+    )
+    advertisement_ids = []
+    for i in range(advertisements):
+        advertisement_id = str(
+            db.advertisements.insert_one(
+                {
+                    "company_name": f"Company {i}",
+                    "website": "https://treetap.net",
+                    "coupon_info": "10% off",
+                    "trees_per_click": 1,
+                    "advertisement_content": "Plant a tree\\n",
+                    "advertisement_image": "uploads/benchmark.png",
+                    "created_by": "advertiser@benchmark.treetap.net",
+                    "approved": True,
+                    "closed": False,
+                    "trees_planted": 0,
+                    "ngo": "benchmark",
+                }
+            ).inserted_id
+        )
+        coupon_ingest.ingest_coupon_codes(
+            advertisement_id, (f"BENCH-{i}-{j}" for j in range(coupons))
+        )
+        advertisement_ids.append(advertisement_id)
+    return emails, advertisement_ids
+
+
+def _percentile(sorted_values: list, percentile: float):
+    # Nearest rank
+    if not sorted_values:
+        return None
+    index = max(0, int(round(percentile / 100 * len(sorted_values))) - 1)
+    return round(sorted_values[index] * 1000, 3)
+
+
+class Journeys:
+    def __init__(self, client, emails, advertisement_ids):
+        self.client = client
+        self.emails = emails
+        self.advertisement_ids = advertisement_ids
+        self.tokens = [
+            create_access_token({"sub": email}, datetime.timedelta(hours=1))
+            for email in emails
+        ]
+
+    def _auth(self, i: int):
+        return {"Authorization": f"Bearer {self.tokens[i % len(self.tokens)]}"}
+
+    async def signup(self, i: int):
+        return await self.client.post(
+            "/apps/auth/signup",
+            json={
+                "emailAddress": f"signup{i}-{time.time_ns()}@benchmark.treetap.net",
+                "password": PASSWORD,
+            },
+        )
+
+    async def login(self, i: int):
+        return await self.client.post(
+            "/apps/auth/login",
+            data={"username": self.emails[i % len(self.emails)], "password": PASSWORD},
+        )
+
+    async def feed(self, i: int):
+        return await self.client.get("/apps/advertisement/", headers=self._auth(i))
+
+    async def filter(self, i: int):
+        return await self.client.get(
+            "/apps/advertisement/filter",
+            params={"advertisement_ids": ",".join(self.advertisement_ids[:20])},
+            headers=self._auth(i),
+        )
+
+    async def plant(self, i: int):
+        # Walks the (user, advertisement) pairs, each can plant only once
+        advertisement_id = self.advertisement_ids[
+            (i // len(self.emails)) % len(self.advertisement_ids)
+        ]
+        return await self.client.post(
+            "/apps/auth/plant",
+            params={"advertisement_id": advertisement_id},
+            headers=self._auth(i),
+        )
+
+    async def profile(self, i: int):
+        return await self.client.get("/apps/auth/profile", headers=self._auth(i))
+
+
+async def run_route(journeys: Journeys, route: str, requests: int, concurrency: int):
+    journey = getattr(journeys, route)
+    latencies = []
+    statuses = defaultdict(int)
+    next_request = iter(range(requests))
+
+    async def worker():
+        for i in next_request:
+            start = time.perf_counter()
+            try:
+                response = await journey(i)
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "statuses": dict(statuses),
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+    }
+
+
+async def run_under_login_storm(
+    journeys: Journeys, route: str, requests: int, concurrency: int, storm: int
+):
+    # Logs in from `storm` clients back to back while the route is measured
+    stopped = asyncio.Event()
+    logins = defaultdict(int)
+
+    async def login_worker(offset: int):
+        i = offset
+        while not stopped.is_set():
+            try:
+                response = await journeys.login(i)
+                logins[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                logins[type(e).__name__] += 1
+            i += storm
+
+    workers = [asyncio.create_task(login_worker(i)) for i in range(storm)]
+    # The first logins are in flight before the route is measured
+    await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    result = await run_route(journeys, route, requests, concurrency)
+    elapsed = time.perf_counter() - start
+    stopped.set()
+    await asyncio.gather(*workers)
+    result["login_storm"] = {
+        "concurrency": storm,
+        "statuses": dict(logins),
+        "throughput_rps": round(sum(logins.values()) / elapsed, 1),
+    }
+    return result
+
+
+async def run(args, emails, advertisement_ids):
+    if args.url:
+        lifespan = contextlib.nullcontext()
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        from app.main import app
+
+        lifespan = app.router.lifespan_context(app)
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://benchmark"
+        )
+    results = {}
+    async with lifespan, client:
+        journeys = Journeys(client, emails, advertisement_ids)
+        for route in args.routes.split(","):
+            results[route] = await run_route(
+                journeys, route, args.requests, args.concurrency
+            )
+            print(route, json.dumps(results[route]), flush=True)
+        if args.login_storm:
+            for route in args.storm_routes.split(","):
+                name = f"{route}+login_storm"
+                results[name] = await run_under_login_storm(
+                    journeys, route, args.requests, args.concurrency, args.login_storm
+                )
+                print(name, json.dumps(results[name]), flush=True)
+    return results
+
+
+def _get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"compared with {baseline['commit']} ({baseline_path})")
+    for route, result in results["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before[key] and result[key] is not None:
+                change = (result[key] - before[key]) / before[key] * 100
+                changes.append(f"{key} {before[key]} -> {result[key]} ({change:+.1f}%)")
+        print(f"{route}: {', '.join(changes)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.journeys")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--advertisements", type=int, default=50)
+    parser.add_argument("--coupons", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=1000, help="Per route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument(
+        "--login-storm", type=int, default=0, help="Concurrent logins, 0 for none"
+    )
+    parser.add_argument("--storm-routes", default="feed,profile")
+    parser.add_argument("--url", help="Benchmark a running server instead")
+    parser.add_argument("--output", help="Defaults to benchmarks/results/")
+    parser.add_argument("--compare", help="Results of an earlier run")
+    args = parser.parse_args(argv)
+
+    emails, advertisement_ids = seed(args.users, args.advertisements, args.coupons)
+    results = {
+        "commit": _get_commit(),
+        "timestamp": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "config": {
+            "users": args.users,
+            "advertisements": args.advertisements,
+            "coupons": args.coupons,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "login_storm": args.login_storm,
+            "target": args.url or "asgi",
+        },
+        "routes": asyncio.run(run(args, emails, advertisement_ids)),
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{results['timestamp'].replace(':', '')}-{results['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Metrics middleware overhead, run with `python -m benchmarks.metrics_overhead`
+
+Calls a trivial route through the ASGI interface, without a server or a
+network in between, with and without MetricsMiddleware and reports the
+difference per request.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from fastapi import FastAPI
+
+from app.utils.metrics import MetricsMiddleware
+
+
+def _create_app(instrumented: bool):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"item_id": item_id}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def _call(app, path: str):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def _time(app, requests: int):
+    # Warm up the route and the label children first
+    for i in range(100):
+        await _call(app, f"/items/{i}")
+    start = time.perf_counter()
+    for i in range(requests):
+        await _call(app, f"/items/{i}")
+    return (time.perf_counter() - start) / requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.metrics_overhead")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    baseline, instrumented = [], []
+    for _ in range(args.rounds):
+        baseline.append(asyncio.run(_time(_create_app(False), args.requests)))
+        instrumented.append(asyncio.run(_time(_create_app(True), args.requests)))
+    # The fastest round is the least disturbed by anything else on the host
+    result = {
+        "requests": args.requests,
+        "baseline_us": round(min(baseline) * 1e6, 2),
+        "instrumented_us": round(min(instrumented) * 1e6, 2),
+    }
+    result["overhead_us"] = round(result["instrumented_us"] - result["baseline_us"], 2)
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Sustained clicks on one advertisement, run with
+`python -m benchmarks.single_ad_clicks`
+
+Every click of a hot advertisement updates its document, which serializes
+concurrent /plant transactions on it. This drives plant_tree for a single
+advertisement from many threads, like the threadpool of the /plant route,
+once writing the tree counters in the transaction and once with
+TREES_WRITE_BEHIND, and reports clicks per second and latency for both.
+
+Transactions need a replica set, run with MONGO_TRANSACTIONS=false against a
+standalone mongod. MONGO_DB_NAME must name a benchmark database.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Settings read when the app is imported
+os.environ.setdefault("MONGO_DB_NAME", "treetap_benchmark")
+
+from bson import ObjectId  # noqa: E402
+
+from app.auth.service import coupon_ingest, plant_db  # noqa: E402
+from app.utils import indexes  # noqa: E402
+from app.utils.counters import counters  # noqa: E402
+from benchmarks import get_benchmark_db  # noqa: E402
+
+
+def _percentile(sorted_values: list, percentile: float):
+    index = max(0, int(round(percentile / 100 * len(sorted_values))) - 1)
+    return round(sorted_values[index] * 1000, 3)
+
+
+def _seed(db, clicks: int):
+    advertisement_id = str(
+        db.advertisements.insert_one(
+            {
+                "company_name": "single ad benchmark",
+                "created_by": "advertiser@benchmark.treetap.net",
+                "approved": True,
+                "closed": False,
+                "trees_per_click": 1,
+                "trees_planted": 0,
+            }
+        ).inserted_id
+    )
+    # One spare coupon so the advertisement stays open
+    coupon_ingest.ingest_coupon_codes(
+        advertisement_id, (f"HOT-{advertisement_id}-{i}" for i in range(clicks + 1))
+    )
+    return advertisement_id
+
+
+def run(db, write_behind: bool, clicks: int, concurrency: int):
+    plant_db.TREES_WRITE_BEHIND = write_behind
+    advertisement_id = _seed(db, clicks)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def click(i: int):
+        start = time.perf_counter()
+        try:
+            plant_db.plant_tree(advertisement_id, f"hot{i}@benchmark.treetap.net")
+        except Exception as e:
+            with lock:
+                errors.append(type(e).__name__)
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    if write_behind:
+        counters.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(click, range(clicks)))
+    # Buffered counters count as done once written
+    if write_behind:
+        counters.stop()
+    elapsed = time.perf_counter() - start
+
+    trees_planted = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})[
+        "trees_planted"
+    ]
+    db.coupons.delete_many({"advertisement_id": advertisement_id})
+    db.advertisements.delete_one({"_id": ObjectId(advertisement_id)})
+    latencies.sort()
+    return {
+        "clicks": clicks,
+        "errors": len(errors),
+        "clicks_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": _percentile(latencies, 50) if latencies else None,
+        "p99_ms": _percentile(latencies, 99) if latencies else None,
+        "trees_planted": trees_planted,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.single_ad_clicks")
+    parser.add_argument("--clicks", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=40)
+    args = parser.parse_args(argv)
+
+    db = get_benchmark_db()
+    indexes.ensure_indexes(db)
+    result = {
+        "transactions": plant_db.MONGO_TRANSACTIONS,
+        "concurrency": args.concurrency,
+        "direct": run(db, False, args.clicks, args.concurrency),
+        "write_behind": run(db, True, args.clicks, args.concurrency),
+    }
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+gunicorn settings, run with `python -m app.server` or
+`gunicorn -c gunicorn.conf.py app.main:app`
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+# Every worker writes its samples to this directory and /metrics aggregates
+# them. It has to be set before prometheus_client is imported, which happens
+# after this file is loaded. The default directory belongs to this master
+# process and is removed when it exits.
+_default_multiproc_dir = os.path.join(
+    tempfile.gettempdir(), f"treetap-prometheus-{os.getpid()}"
+)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", _default_multiproc_dir)
+
+# /metrics and the other stats endpoints are only answered on the internal
+# address, keep it off the public network
+bind = [
+    os.getenv("BIND", "0.0.0.0:8000"),
+    os.getenv("INTERNAL_BIND", "127.0.0.1:9100"),
+]
+# The workers are async, one per core keeps every core busy
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "app.server.Worker"
+# Import the app once in the master and fork the workers from it. Every
+# connection, thread and task is created in the lifespan hook of each worker,
+# so nothing is shared across the fork.
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+# Requests in flight get this long to finish on SIGTERM before the workers
+# are killed
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+accesslog = os.getenv("ACCESS_LOG")
+
+
+def on_starting(server):
+    # Samples of a previous run would otherwise be added to this one
+    multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def on_exit(server):
+    if os.environ["PROMETHEUS_MULTIPROC_DIR"] == _default_multiproc_dir:
+        shutil.rmtree(_default_multiproc_dir, ignore_errors=True)
+
+
+def post_fork(server, worker):
+    # Read by the app's lifespan hook to report the worker's cold start
+    os.environ["SERVER_WORKER_FORKED_AT"] = str(time.time())
+    if server.cfg.preload_app:
+        os.environ["SERVER_APP_PRELOADED"] = "1"
+
+
+def child_exit(server, worker):
+    # Drops the live gauges of the dead worker, its counters and histograms
+    # are kept
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,146 @@
+import os
+import threading
+from collections import defaultdict
+from functools import wraps
+
+import mongomock
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+os.environ.setdefault("EMAIL_ADDRESS", "test@treetap.net")
+os.environ.setdefault("EMAIL_PASSWORD", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ADMIN_EMAIL", "admin@treetap.net")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+from app.utils import mongo, query_trace  # noqa: E402
+from app.utils.counters import counters  # noqa: E402
+
+# Runs the tests against a real server when set, mongomock otherwise
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+
+# mongomock does not emit command events, these collection methods are
+# counted as one command each on the current query trace instead
+_commands = {
+    "find": "find",
+    "find_one": "find",
+    "distinct": "distinct",
+    "aggregate": "aggregate",
+    "count_documents": "aggregate",
+    "insert_one": "insert",
+    "insert_many": "insert",
+    "update_one": "update",
+    "update_many": "update",
+    "replace_one": "update",
+    "delete_one": "delete",
+    "delete_many": "delete",
+    "bulk_write": "bulkWrite",
+    "find_one_and_update": "findAndModify",
+}
+_local = threading.local()
+
+
+def _project(document, projection):
+    if document is None or not projection:
+        return document
+    if any(projection.values()):
+        return {key: document[key] for key in projection if key in document}
+    return {key: value for key, value in document.items() if key not in projection}
+
+
+def _traced(method, command_name: str):
+    @wraps(method)
+    def traced(self, *args, **kwargs):
+        # Methods called by other methods are part of the same command
+        if getattr(_local, "depth", 0) == 0:
+            trace = query_trace._current_trace.get()
+            if trace is not None:
+                trace.add(command_name, self.name, 0.0)
+        _local.depth = getattr(_local, "depth", 0) + 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _local.depth -= 1
+
+    return traced
+
+
+def _patch_mongomock(monkeypatch):
+    collection_class = mongomock.collection.Collection
+    for method_name, command_name in _commands.items():
+        monkeypatch.setattr(
+            collection_class,
+            method_name,
+            _traced(getattr(collection_class, method_name), command_name),
+        )
+
+    # mongomock is not thread safe, the lock stands in for the server
+    # applying every write atomically. It also only narrows the update to the
+    # found document when the projection keeps _id.
+    lock = threading.RLock()
+    find_and_modify = collection_class._find_and_modify
+
+    def locked_find_and_modify(self, query, projection=None, *args, **kwargs):
+        with lock:
+            document = find_and_modify(self, query, None, *args, **kwargs)
+        return _project(document, projection)
+
+    monkeypatch.setattr(collection_class, "_find_and_modify", locked_find_and_modify)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    if MONGO_TEST_URI:
+        client = MongoClient(
+            MONGO_TEST_URI, event_listeners=[query_trace.command_tracer]
+        )
+        async_client = AsyncIOMotorClient(
+            MONGO_TEST_URI, event_listeners=[query_trace.command_tracer]
+        )
+        client.drop_database("treetap_test")
+    else:
+        _patch_mongomock(monkeypatch)
+        client = mongomock.MongoClient()
+        async_client = AsyncMongoMockClient(mock_mongo_client=client)
+    database = client.treetap_test
+    monkeypatch.setattr(mongo, "_client", client)
+    monkeypatch.setattr(mongo, "_db", database)
+    monkeypatch.setattr(mongo, "_async_client", async_client)
+    monkeypatch.setattr(mongo, "_async_db", async_client.treetap_test)
+    # Increments buffered by earlier tests belong to their database
+    monkeypatch.setattr(counters, "_pending", defaultdict(lambda: defaultdict(int)))
+    yield database
+    if MONGO_TEST_URI:
+        client.drop_database("treetap_test")
+    async_client.close()
+    client.close()
+
+
+@pytest.fixture
+def client(db):
+    # The lifespan hook is not run, so no background threads are started
+    from fastapi.testclient import TestClient
+
+    from app.advertisement.service.feed_cache import feed_cache
+    from app.main import app
+
+    feed_cache.invalidate()
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def login():
+    # Makes the requests of the test client authenticated as the given user
+    from app.auth.models.user import User
+    from app.main import app
+    from app.utils.utils import get_current_user
+
+    def login(email_address: str):
+        user = User.construct(emailAddress=email_address)
+        app.dependency_overrides[get_current_user] = lambda: user
+        return user
+
+    return login
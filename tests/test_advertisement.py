@@ -0,0 +1,118 @@
+import datetime
+
+from bson import ObjectId
+
+from app.advertisement.service import analytics
+from app.utils.counters import counters
+from app.utils.query_trace import assert_max_queries
+
+
+def _insert_advertisements(db, size: int):
+    advertisements = [
+        {
+            "_id": ObjectId(),
+            "company_name": f"Company {i}",
+            "advertisement_content": "Plant a tree",
+            "created_by": "advertiser@treetap.net",
+            "approved": True,
+            "closed": False,
+        }
+        for i in range(size)
+    ]
+    db.advertisements.insert_many(advertisements)
+    return [str(advertisement["_id"]) for advertisement in advertisements]
+
+
+def test_feed_queries_do_not_grow_with_claimed_coupons(db, client, login):
+    advertisement_ids = _insert_advertisements(db, 30)
+    db.coupons.insert_many(
+        [
+            {"advertisement_id": advertisement_id, "code": advertisement_id}
+            for advertisement_id in advertisement_ids
+        ]
+    )
+    db.coupons.update_many(
+        {"advertisement_id": {"$in": advertisement_ids[:20]}},
+        {"$set": {"user_email": "user@treetap.net"}},
+    )
+    login("user@treetap.net")
+
+    # One query for the feed cache and one for the user's coupons
+    with assert_max_queries(2) as traces:
+        response = client.get("/apps/advertisement/")
+
+    assert response.status_code == 200
+    assert [trace.count for trace in traces] == [0, 2]
+    already_done = [advertisement["already_done"] for advertisement in response.json()]
+    assert already_done == [True] * 20 + [False] * 10
+
+    # The cached feed leaves only the user's coupons to look up
+    with assert_max_queries(1):
+        client.get("/apps/advertisement/")
+
+
+def test_stock_counts_coupons_of_advertisements_without_counters(db, client, login):
+    (advertisement_id,) = _insert_advertisements(db, 1)
+    db.coupons.insert_many(
+        [{"advertisement_id": advertisement_id, "code": f"C{i}"} for i in range(5)]
+    )
+    db.coupons.update_one({}, {"$set": {"user_email": "user@treetap.net"}})
+    login("advertiser@treetap.net")
+
+    response = client.get(f"/apps/advertisement/{advertisement_id}/stock")
+
+    assert response.json() == {
+        "total": 5,
+        "remaining": 4,
+        "claimed": 1,
+        "closed": False,
+    }
+
+
+def test_stock_includes_claims_not_yet_written(db, client, login):
+    (advertisement_id,) = _insert_advertisements(db, 1)
+    db.advertisements.update_one(
+        {}, {"$set": {"coupons_total": 5, "coupons_remaining": 5}}
+    )
+    counters.increment(
+        "advertisements", {"_id": ObjectId(advertisement_id)}, "coupons_remaining", -2
+    )
+    login("advertiser@treetap.net")
+
+    response = client.get(f"/apps/advertisement/{advertisement_id}/stock")
+
+    assert response.json()["remaining"] == 3
+    assert response.json()["claimed"] == 2
+
+
+def test_only_administrators_can_refill_coupons(db, client, login):
+    (advertisement_id,) = _insert_advertisements(db, 1)
+    login("advertiser@treetap.net")
+
+    response = client.put(
+        f"/apps/advertisement/{advertisement_id}/coupons", json=["NEW-1"]
+    )
+
+    assert response.status_code == 401
+    assert db.coupons.count_documents({}) == 0
+
+
+def test_revalidated_feed_is_not_counted_as_impressions(db, client, login):
+    (advertisement_id,) = _insert_advertisements(db, 1)
+    login("user@treetap.net")
+    impressions = {
+        "advertisement_id": advertisement_id,
+        "granularity": "day",
+        "bucket": analytics.get_bucket(datetime.datetime.utcnow(), "day"),
+    }
+
+    for path in ("/apps/advertisement/", "/apps/advertisement/filter"):
+        params = {"advertisement_ids": advertisement_id}
+        response = client.get(path, params=params)
+        etag = response.headers["etag"]
+        not_modified = client.get(path, params=params, headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+
+    assert (
+        counters.pending("advertisement_stats", impressions, "impressions", True) == 2
+    )
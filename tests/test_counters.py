@@ -0,0 +1,38 @@
+import threading
+import time
+
+from app.utils.counters import CounterAggregator
+
+
+def test_concurrent_flushes_keep_the_deltas_being_written(db, monkeypatch):
+    aggregator = CounterAggregator(60)
+    release = threading.Event()
+    write = aggregator._write
+    writes = []
+
+    def slow_write(pending):
+        writes.append(pending)
+        if len(writes) == 1:
+            release.wait(5)
+        write(pending)
+
+    monkeypatch.setattr(aggregator, "_write", slow_write)
+    document_filter = {"emailAddress": "user@treetap.net"}
+    db.users.insert_one({"emailAddress": "user@treetap.net", "trees_planted": 0})
+
+    aggregator.increment("users", document_filter, "trees_planted", 3)
+    first = threading.Thread(target=aggregator.flush)
+    first.start()
+    while not writes:
+        time.sleep(0.01)
+    aggregator.increment("users", document_filter, "trees_planted", 2)
+    second = threading.Thread(target=aggregator.flush)
+    second.start()
+    time.sleep(0.1)
+
+    assert aggregator.pending("users", document_filter, "trees_planted") == 5
+    release.set()
+    first.join()
+    second.join()
+    assert aggregator.pending("users", document_filter, "trees_planted") == 0
+    assert db.users.find_one()["trees_planted"] == 5
@@ -0,0 +1,96 @@
+import random
+import threading
+
+from app.auth.service.coupon_db import (
+    archive_duplicate_coupons,
+    claim_random_coupon_code,
+)
+from app.utils import indexes
+
+
+def _insert_coupons(db, advertisement_id: str, size: int):
+    db.coupons.insert_many(
+        [
+            {
+                "advertisement_id": advertisement_id,
+                "code": f"C{i}",
+                "random": random.random(),
+            }
+            for i in range(size)
+        ]
+    )
+
+
+def _claim_in_parallel(advertisement_id: str, users: int):
+    claims = [None] * users
+    barrier = threading.Barrier(users)
+
+    def claim(i):
+        barrier.wait()
+        claims[i] = claim_random_coupon_code(advertisement_id, f"user{i}@treetap.net")
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return claims
+
+
+def test_parallel_claims_get_different_coupons(db):
+    _insert_coupons(db, "ad", 100)
+
+    claims = _claim_in_parallel("ad", 100)
+
+    codes = [claim["code"] for claim in claims]
+    assert len(set(codes)) == 100
+    assert db.coupons.count_documents({"user_email": {"$exists": False}}) == 0
+
+
+def test_parallel_claims_stop_when_out_of_coupons(db):
+    _insert_coupons(db, "ad", 20)
+
+    claims = _claim_in_parallel("ad", 50)
+
+    codes = [claim["code"] for claim in claims if claim]
+    assert len(codes) == len(set(codes)) == 20
+    for claim in claims:
+        if claim:
+            owner = db.coupons.find_one({"code": claim["code"]})["user_email"]
+            assert owner == claim["user_email"]
+
+
+def test_claim_hands_out_coupons_without_random_key_last(db):
+    db.coupons.insert_one({"advertisement_id": "ad", "code": "LEGACY"})
+    _insert_coupons(db, "ad", 1)
+
+    first = claim_random_coupon_code("ad", "a@treetap.net")
+    second = claim_random_coupon_code("ad", "b@treetap.net")
+
+    assert first["code"] == "C0"
+    assert second["code"] == "LEGACY"
+    assert claim_random_coupon_code("ad", "c@treetap.net") is None
+
+
+def test_duplicates_are_archived_so_the_unique_indexes_can_be_built(db):
+    db.coupons.insert_many(
+        [
+            {"advertisement_id": "ad", "code": "A", "user_email": "a@treetap.net"},
+            {"advertisement_id": "ad", "code": "B", "user_email": "a@treetap.net"},
+            {"advertisement_id": "ad", "code": "C"},
+            {"advertisement_id": "ad", "code": "C", "user_email": "b@treetap.net"},
+            {"advertisement_id": "other", "code": "A"},
+        ]
+    )
+
+    assert archive_duplicate_coupons() == ["ad"]
+
+    remaining = db.coupons.find({}, {"_id": 0, "random": 0})
+    assert sorted(remaining, key=lambda coupon: coupon["code"]) == [
+        {"advertisement_id": "ad", "code": "A", "user_email": "a@treetap.net"},
+        {"advertisement_id": "other", "code": "A"},
+        {"advertisement_id": "ad", "code": "C", "user_email": "b@treetap.net"},
+    ]
+    assert db.duplicate_coupons.count_documents({}) == 2
+    assert indexes.ensure_indexes(db) == []
+    assert archive_duplicate_coupons() == []
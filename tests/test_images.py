@@ -0,0 +1,76 @@
+import io
+import os
+
+import pytest
+from bson import ObjectId
+from PIL import Image
+
+from app.advertisement.service import images
+
+
+def _write_jpeg(path):
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation, rotated 90 degrees clockwise
+    exif[0x010F] = "Camera maker"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", (1600, 800), (20, 120, 40)).save(path, "JPEG", exif=exif)
+
+
+def test_images_over_the_pixel_limit_are_refused(monkeypatch):
+    # Between the limit and twice the limit Pillow only warns
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    file = io.BytesIO()
+    Image.new("RGB", (50, 30)).save(file, "PNG")
+
+    with pytest.raises(ValueError, match="too large"):
+        images.validate_image(file)
+
+
+def test_renditions_replace_the_upload_with_a_stripped_copy(db, tmp_path):
+    # The extension comes from the client, the format is detected
+    upload_path = str(tmp_path / "uploads" / "upload.png")
+    _write_jpeg(upload_path)
+    advertisement_id = db.advertisements.insert_one(
+        {"advertisement_image": upload_path}
+    ).inserted_id
+
+    images.generate_renditions(str(advertisement_id), upload_path)
+
+    assert not os.path.exists(upload_path)
+    stripped_path = str(tmp_path / "uploads" / "upload_original.jpg")
+    with Image.open(stripped_path) as stripped:
+        assert stripped.size == (800, 1600)
+        assert not stripped.getexif()
+    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
+    assert advertisement["advertisement_image"] == stripped_path
+    feed_webp = advertisement["advertisement_image_variants"]["feed"]["webp"]
+    assert feed_webp == str(tmp_path / "uploads" / "upload_original_feed.webp")
+    with Image.open(feed_webp) as rendition:
+        assert max(rendition.size) == images.RENDITION_SIZES["feed"]
+
+
+def test_original_served_for_a_size_is_revalidated(client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_jpeg("uploads/upload.jpg")
+
+    fallback = client.get(
+        "/apps/advertisement/images",
+        params={"file_name": "uploads/upload.jpg", "size": "feed"},
+    )
+    original = client.get(
+        "/apps/advertisement/images", params={"file_name": "uploads/upload.jpg"}
+    )
+
+    assert fallback.status_code == 200
+    assert fallback.headers["cache-control"] == "no-cache"
+    assert "immutable" in original.headers["cache-control"]
+
+    images.generate_renditions(str(ObjectId()), "uploads/upload.jpg")
+    rendition = client.get(
+        "/apps/advertisement/images",
+        params={"file_name": "uploads/upload_original.jpg", "size": "feed"},
+        headers={"Accept": "image/webp"},
+    )
+
+    assert rendition.headers["content-type"] == "image/webp"
+    assert "immutable" in rendition.headers["cache-control"]
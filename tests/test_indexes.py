@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from app.utils import indexes
+
+# explain needs a real server, mongomock has no query planner
+requires_server = pytest.mark.skipif(
+    not os.getenv("MONGO_TEST_URI"), reason="MONGO_TEST_URI is not set"
+)
+
+
+class _Collection:
+    def __init__(self, explanation):
+        self.explanation = explanation
+
+    def find(self, query):
+        return self
+
+    def explain(self):
+        return self.explanation
+
+
+def _explained(winning_plan):
+    return {"coupons": _Collection({"queryPlanner": {"winningPlan": winning_plan}})}
+
+
+def _get_prefix_fields(query: dict, keys: list):
+    # Fields of the query the index can seek on, a prefix of its keys
+    fields = []
+    for key in keys:
+        if key not in query:
+            break
+        fields.append(key)
+    return fields
+
+
+@pytest.mark.parametrize("collection_name, query", indexes.HOT_QUERIES)
+def test_hot_query_matches_an_index_prefix(collection_name, query):
+    for index_model in indexes.INDEXES[collection_name]:
+        document = index_model.document
+        keys = list(document["key"])
+        partial_fields = document.get("partialFilterExpression", {})
+        if _get_prefix_fields(query, keys) and all(
+            field in query for field in partial_fields
+        ):
+            return
+    pytest.fail(f"No index of {collection_name} can answer {query}")
+
+
+@requires_server
+@pytest.mark.parametrize("collection_name, query", indexes.HOT_QUERIES)
+def test_hot_query_is_index_backed(db, collection_name, query):
+    assert indexes.ensure_indexes(db) == []
+    assert indexes.is_index_backed(db, collection_name, query)
+
+
+def test_is_index_backed_reads_classic_plans():
+    index_scan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+    assert indexes.is_index_backed(_explained(index_scan), "coupons", {})
+    assert not indexes.is_index_backed(_explained({"stage": "COLLSCAN"}), "coupons", {})
+
+
+def test_is_index_backed_reads_slot_based_plans():
+    or_plan = {
+        "queryPlan": {
+            "stage": "OR",
+            "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}],
+        }
+    }
+    assert not indexes.is_index_backed(_explained(or_plan), "coupons", {})
+    assert indexes.is_index_backed(
+        _explained({"queryPlan": {"stage": "IDHACK"}}), "coupons", {}
+    )
+
+
+def test_missing_required_index_stops_the_app(db):
+    db.coupons.insert_one({"advertisement_id": "ad", "user_email": "a@treetap.net"})
+
+    with pytest.raises(RuntimeError, match="user_email_advertisement_id_unique"):
+        indexes.check_required_indexes(db)
+
+    db.coupons.create_index(
+        [("user_email", 1), ("advertisement_id", 1)],
+        name="user_email_advertisement_id_unique",
+        unique=True,
+    )
+    with pytest.raises(RuntimeError, match="advertisement_id_code_unique"):
+        indexes.check_required_indexes(db)
+
+    db.coupons.create_index(
+        [("advertisement_id", 1), ("code", 1)],
+        name="advertisement_id_code_unique",
+        unique=True,
+    )
+    indexes.check_required_indexes(db)
@@ -0,0 +1,45 @@
+from app.leaderboard.service import database
+from app.leaderboard.service.leaderboards import Leaderboard, Leaderboards
+from app.utils.counters import counters
+
+
+def test_increments_move_members_up_the_ranking():
+    board = Leaderboard()
+    board.load({"a": 5, "b": 3, "c": 3})
+
+    board.increment("c", 3)
+    board.increment("d", 5)
+
+    assert board.get_top(3) == [
+        {"rank": 1, "member": "c", "score": 6},
+        {"rank": 2, "member": "a", "score": 5},
+        {"rank": 2, "member": "d", "score": 5},
+    ]
+    assert board.get_rank("b") == {"rank": 4, "score": 3}
+    assert len(board) == 4
+
+
+def test_refresh_keeps_increments_not_yet_written(db):
+    db.leaderboard_scores.insert_many(
+        [
+            {"board": "users", "member": "a@treetap.net", "score": 5},
+            {"board": "users", "member": "b@treetap.net", "score": 6},
+        ]
+    )
+    leaderboards = Leaderboards(60)
+    leaderboards.refresh()
+    leaderboards.record_plant("a@treetap.net", "advertiser@treetap.net", None, 2)
+
+    leaderboards.refresh()
+
+    users = leaderboards.boards["users"]
+    assert users.get_rank("a@treetap.net") == {"rank": 1, "score": 7}
+    assert leaderboards.boards["advertisers"].get_rank("advertiser@treetap.net") == {
+        "rank": 1,
+        "score": 2,
+    }
+    counters.flush()
+    leaderboards.refresh()
+    users = leaderboards.boards["users"]
+    assert users.get_rank("a@treetap.net") == {"rank": 1, "score": 7}
+    assert database.get_scores("users")["a@treetap.net"] == 7
@@ -0,0 +1,88 @@
+import asyncio
+import socket
+import sqlite3
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.utils import mail
+
+
+class _Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server(monkeypatch, tmp_path):
+    inbox = _Inbox()
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    controller = Controller(inbox, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(mail, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(mail, "MAIL_PORT", port)
+    monkeypatch.setattr(mail, "MAIL_SSL_TLS", False)
+    monkeypatch.setattr(mail, "MAIL_STARTTLS", False)
+    monkeypatch.setattr(mail, "MAIL_USERNAME", None)
+    monkeypatch.setattr(mail, "MAIL_QUEUE_PATH", str(tmp_path / "mail.sqlite3"))
+    monkeypatch.setattr(mail, "MAIL_RETRY_BASE_SECONDS", 0)
+    mail._create_queue()
+    yield inbox
+    controller.stop()
+
+
+def _queue():
+    with sqlite3.connect(mail.MAIL_QUEUE_PATH) as connection:
+        return connection.execute(
+            "SELECT recipients, attempts, failed FROM outbound_mail ORDER BY id"
+        ).fetchall()
+
+
+async def _send_batches(count: int):
+    worker = mail.MailWorker()
+    try:
+        for _ in range(count):
+            await worker.send_batch()
+    finally:
+        await worker.close()
+
+
+def test_batch_is_sent_over_one_connection(smtp_server):
+    for i in range(3):
+        mail._insert_message("Hello", [f"user{i}@treetap.net"], "Hi", "plain")
+
+    asyncio.run(_send_batches(1))
+
+    assert [envelope.rcpt_tos for envelope in smtp_server.messages] == [
+        ["user0@treetap.net"],
+        ["user1@treetap.net"],
+        ["user2@treetap.net"],
+    ]
+    assert _queue() == []
+
+
+def test_unbuildable_messages_are_retried_then_failed(smtp_server, monkeypatch):
+    monkeypatch.setattr(mail, "MAIL_MAX_ATTEMPTS", 2)
+    mail._insert_message("Unset admin address", [None], "Hi", "plain")
+    mail._insert_message("Injected header", ["a@treetap.net\nBcc: x"], "Hi", "plain")
+    mail._insert_message("Hello", ["user@treetap.net"], "Hi", "plain")
+
+    asyncio.run(_send_batches(1))
+
+    # The rest of the batch is still sent and the broken messages are due
+    # again without waiting for their lease to run out
+    assert [envelope.rcpt_tos for envelope in smtp_server.messages] == [
+        ["user@treetap.net"]
+    ]
+    assert [row[1:] for row in _queue()] == [(1, 0), (1, 0)]
+
+    asyncio.run(_send_batches(1))
+
+    assert [row[1:] for row in _queue()] == [(2, 1), (2, 1)]
+    assert len(smtp_server.messages) == 1
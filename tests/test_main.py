@@ -0,0 +1,26 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+INTERNAL_PATHS = [
+    "/metrics",
+    "/mongo/pool",
+    "/cache/principals",
+    "/cache/feed",
+    "/rate-limit",
+]
+
+
+@pytest.mark.parametrize("path", INTERNAL_PATHS)
+def test_internal_endpoints_are_hidden_on_the_public_port(path):
+    response = TestClient(app, base_url="http://treetap.net").get(path)
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("path", INTERNAL_PATHS)
+def test_internal_endpoints_are_served_on_the_internal_port(path):
+    response = TestClient(app, base_url="http://127.0.0.1:9100").get(path)
+
+    assert response.status_code == 200
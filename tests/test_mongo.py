@@ -0,0 +1,26 @@
+from app.utils import mongo
+
+
+class _Event:
+    pass
+
+
+def test_pool_stats_are_reported_per_client(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "50")
+    monkeypatch.setenv("MONGO_ASYNC_MAX_POOL_SIZE", "20")
+    monkeypatch.setattr(mongo, "pool_stats_listener", mongo.PoolStatsListener())
+    monkeypatch.setattr(mongo, "async_pool_stats_listener", mongo.PoolStatsListener())
+    for _ in range(3):
+        mongo.pool_stats_listener.connection_created(_Event())
+    mongo.async_pool_stats_listener.connection_created(_Event())
+    mongo.async_pool_stats_listener.connection_check_out_started(_Event())
+    mongo.async_pool_stats_listener.connection_checked_out(_Event())
+
+    stats = mongo.get_pool_stats()
+
+    assert stats["sync"]["open"] == 3
+    assert stats["sync"]["checked_out"] == 0
+    assert stats["sync"]["max_pool_size"] == 50
+    assert stats["async"]["open"] == 1
+    assert stats["async"]["checked_out"] == 1
+    assert stats["async"]["max_pool_size"] == 20
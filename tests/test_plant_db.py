@@ -0,0 +1,121 @@
+import random
+
+import pytest
+from bson import ObjectId
+
+from app.auth.service import plant_db
+from app.utils.counters import counters
+
+
+@pytest.fixture(autouse=True)
+def no_transactions(monkeypatch):
+    # mongomock has no sessions
+    monkeypatch.setattr(plant_db, "MONGO_TRANSACTIONS", False)
+
+
+def _insert_advertisement(db, coupons: int):
+    advertisement_id = db.advertisements.insert_one(
+        {
+            "created_by": "advertiser@treetap.net",
+            "approved": True,
+            "closed": False,
+            "trees_per_click": 2,
+            "trees_planted": 0,
+        }
+    ).inserted_id
+    if coupons:
+        db.coupons.insert_many(
+            [
+                {
+                    "advertisement_id": str(advertisement_id),
+                    "code": f"C{i}",
+                    "random": random.random(),
+                }
+                for i in range(coupons)
+            ]
+        )
+    return str(advertisement_id)
+
+
+def test_plant_claims_a_coupon_and_credits_the_trees(db):
+    advertisement_id = _insert_advertisement(db, 3)
+    db.users.insert_one({"emailAddress": "user@treetap.net", "trees_planted": 0})
+
+    result = plant_db.plant_tree(advertisement_id, "user@treetap.net")
+
+    assert result["trees_planted"] == 2
+    assert result["coupon"]["user_email"] == "user@treetap.net"
+    assert db.users.find_one()["trees_planted"] == 2
+    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
+    assert advertisement["trees_planted"] == 2
+
+
+def test_second_plant_on_the_same_advertisement_is_refused(db):
+    # Without the unique index, as when it could not be built
+    advertisement_id = _insert_advertisement(db, 3)
+    db.users.insert_one({"emailAddress": "user@treetap.net"})
+    plant_db.plant_tree(advertisement_id, "user@treetap.net")
+
+    with pytest.raises(plant_db.PlantError, match="already has a coupon"):
+        plant_db.plant_tree(advertisement_id, "user@treetap.net")
+
+    assert db.coupons.count_documents({"user_email": "user@treetap.net"}) == 1
+
+
+def _set_inventory(db, advertisement_id: str, coupons: int):
+    db.advertisements.update_one(
+        {"_id": ObjectId(advertisement_id)},
+        {"$set": {"coupons_total": coupons, "coupons_remaining": coupons}},
+    )
+
+
+def test_claims_are_counted_off_the_inventory_in_the_transaction(db):
+    advertisement_id = _insert_advertisement(db, 3)
+    _set_inventory(db, advertisement_id, 3)
+    plant_db.plant_tree(advertisement_id, "a@treetap.net")
+    plant_db.plant_tree(advertisement_id, "b@treetap.net")
+
+    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
+    assert advertisement["coupons_remaining"] == 1
+    assert advertisement["trees_planted"] == 4
+    assert counters.get_pending("advertisements") == []
+
+
+def test_claims_are_counted_off_the_inventory_in_bulk_with_write_behind(
+    db, monkeypatch
+):
+    monkeypatch.setattr(plant_db, "TREES_WRITE_BEHIND", True)
+    advertisement_id = _insert_advertisement(db, 3)
+    _set_inventory(db, advertisement_id, 3)
+    plant_db.plant_tree(advertisement_id, "a@treetap.net")
+    plant_db.plant_tree(advertisement_id, "b@treetap.net")
+
+    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
+    assert advertisement["coupons_remaining"] == 3
+    counters.flush()
+    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
+    assert advertisement["coupons_remaining"] == 1
+
+
+def test_last_coupon_closes_the_advertisement(db):
+    advertisement_id = _insert_advertisement(db, 2)
+
+    first = plant_db.plant_tree(advertisement_id, "a@treetap.net")
+    second = plant_db.plant_tree(advertisement_id, "b@treetap.net")
+
+    assert not first["closed"]
+    assert second["closed"]
+    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
+    assert advertisement["closed"]
+    assert "coupons_remaining" not in advertisement
+
+
+def test_click_without_coupons_closes_the_advertisement(db):
+    # The last claims raced past the check, the advertisement is still open
+    advertisement_id = _insert_advertisement(db, 0)
+
+    with pytest.raises(plant_db.OutOfCouponsError):
+        plant_db.plant_tree(advertisement_id, "a@treetap.net")
+
+    advertisement = db.advertisements.find_one({"_id": ObjectId(advertisement_id)})
+    assert advertisement["closed"]
@@ -0,0 +1,78 @@
+import datetime
+import os
+
+import pytest
+
+from app.auth.service import database
+from app.auth.service.coupon_db import claim_random_coupon_code
+
+# mongomock has no $lookup with let
+requires_server = pytest.mark.skipif(
+    not os.getenv("MONGO_TEST_URI"), reason="MONGO_TEST_URI is not set"
+)
+
+
+def _insert_claims(db, email_address: str):
+    # Claimed in the opposite order of creation
+    claimed_at = datetime.datetime(2023, 4, 1)
+    db.coupons.insert_many(
+        [
+            {
+                "advertisement_id": f"ad{i}",
+                "code": f"C{i}",
+                "user_email": email_address,
+                "claimed_at": claimed_at - datetime.timedelta(hours=i),
+            }
+            for i in range(3)
+        ]
+    )
+
+
+def test_claims_record_when_they_were_made(db):
+    db.coupons.insert_one({"advertisement_id": "ad", "code": "C", "random": 0.5})
+
+    coupon = claim_random_coupon_code("ad", "user@treetap.net")
+
+    assert isinstance(coupon["claimed_at"], datetime.datetime)
+
+
+@requires_server
+def test_profile_lists_the_latest_claims_first(db):
+    db.users.insert_one({"emailAddress": "user@treetap.net", "trees_planted": 6})
+    _insert_claims(db, "user@treetap.net")
+
+    profile = database.get_profile("user@treetap.net", 2)
+
+    assert [coupon["code"] for coupon in profile["coupons"]] == ["C0", "C1"]
+    assert profile["trees_planted"] == 6
+
+
+@requires_server
+def test_unchanged_profile_is_revalidated(db, client, login):
+    login("user@treetap.net")
+    db.users.insert_one(
+        {"emailAddress": "user@treetap.net", "trees_planted": 6, "coupons_claimed": 3}
+    )
+    _insert_claims(db, "user@treetap.net")
+
+    first = client.get("/apps/auth/profile")
+    revalidated = client.get(
+        "/apps/auth/profile", headers={"If-None-Match": first.headers["etag"]}
+    )
+    db.users.update_one(
+        {"emailAddress": "user@treetap.net"},
+        {"$inc": {"trees_planted": 2, "coupons_claimed": 1}},
+    )
+    changed = client.get(
+        "/apps/auth/profile", headers={"If-None-Match": first.headers["etag"]}
+    )
+
+    assert first.status_code == 200
+    assert [coupon["code"] for coupon in first.json()["user_coupons"]] == [
+        "C0",
+        "C1",
+        "C2",
+    ]
+    assert revalidated.status_code == 304
+    assert changed.status_code == 200
+    assert changed.json()["num_of_trees"] == 8
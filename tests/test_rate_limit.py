@@ -0,0 +1,63 @@
+import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.utils import rate_limit
+from app.utils.utils import create_access_token
+
+
+def _create_client():
+    app = FastAPI()
+
+    @app.post("/login")
+    def login():
+        return {}
+
+    @app.post("/plant")
+    def plant():
+        return {}
+
+    app.add_middleware(
+        rate_limit.RateLimitMiddleware,
+        store=rate_limit.MemoryStore(100),
+        route_limits={
+            ("POST", "/login"): rate_limit.RateLimit(2, 60),
+            ("POST", "/plant"): rate_limit.RateLimit(2, 60, by_user=True),
+        },
+    )
+    return TestClient(app)
+
+
+def _authorization(email_address: str):
+    token = create_access_token({"sub": email_address}, datetime.timedelta(minutes=5))
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_login_attempts_are_limited_per_address_whatever_the_token(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    client = _create_client()
+
+    # A fresh account per attempt does not buy a fresh bucket
+    statuses = [
+        client.post(
+            "/login", headers=_authorization(f"user{i}@treetap.net")
+        ).status_code
+        for i in range(3)
+    ]
+
+    assert statuses == [200, 200, 429]
+
+
+def test_plants_are_limited_per_user(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    client = _create_client()
+
+    for _ in range(2):
+        client.post("/plant", headers=_authorization("user@treetap.net"))
+
+    blocked = client.post("/plant", headers=_authorization("user@treetap.net"))
+    other = client.post("/plant", headers=_authorization("other@treetap.net"))
+
+    assert blocked.status_code == 429
+    assert other.status_code == 200